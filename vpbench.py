@@ -0,0 +1,818 @@
+'''
+Headless benchmarks of the picker pipeline.
+
+    QT_QPA_PLATFORM=offscreen python vpbench.py [--output results.json] [--sizes 10,100,1000,10000]
+
+Maya is replaced with stub modules and a FakeMaya rig, so it runs outside of Maya.
+Qt benchmarks are skipped when PySide2 can't be imported, they're preceded by regression checks of the Qt layer
+that stop the run with an AssertionError.
+Results are written as json to compare them across commits.
+'''
+import os
+import gc
+import sys
+import time
+import json
+import types
+import shutil
+import tempfile
+import fnmatch
+import platform
+import subprocess
+from collections import OrderedDict, Counter
+
+import vpcore
+from vpcore import VPControlProps, VisibilityResolver, AttributeWatcherRegistry
+
+Namespace = "char"
+Repeats = 5
+DragSceneSize = 500 # the drag fps is always measured on a scene of this size too
+DragFrames = 60
+StartupSizes = [100, 1000, 10000] # cold and warm startup are always measured at these sizes
+
+class FakeMaya(object):
+    '''
+    In-memory stand-in for MayaAccess to run vptools logic outside of Maya.
+    Nodes are stored by long name, every call is counted in callCounts.
+    '''
+    def __init__(self):
+        self.nodes = OrderedDict() # long name -> {"v": visibility, "shape": is shape}
+        self.shortNames = {}
+        self.children = {}
+        self.connections = {} # plug -> destination nodes
+        self.references = OrderedDict() # namespace -> is loaded
+        self.selected = []
+        self.callbacks = {}
+        self.deferred = []
+        self.playingBack = False
+        self.callCounts = Counter()
+        self.warnings = []
+
+    def createNode(self, name, parent=None, visible=True, shape=False):
+        longName = (parent or "") + "|" + name
+        self.nodes[longName] = {"v": visible, "shape": shape}
+        self.shortNames.setdefault(name, longName)
+        self.children.setdefault(parent or "", []).append(longName)
+        return longName
+
+    def setVisibility(self, node, visible):
+        node = self.longNames([node])[0]
+        self.nodes[node]["v"] = visible
+
+        for callbackId, (watched, func) in list(self.callbacks.items()):
+            if watched == node:
+                func(node.rpartition("|")[2]+".visibility") # long attribute name, like plug.name()
+
+    def workspaceDirectory(self):
+        self.callCounts["workspaceDirectory"] += 1
+        return os.getcwd()
+
+    def namespaceNodes(self, namespace):
+        self.callCounts["namespaceNodes"] += 1
+        return [n for n in self.nodes if fnmatch.fnmatchcase(n.rpartition("|")[2], namespace+":*")]
+
+    def longNames(self, nodes, dagOnly=False):
+        self.callCounts["longNames"] += 1
+        if isinstance(nodes, basestring):
+            nodes = [nodes]
+        return [n if n in self.nodes else self.shortNames[n] for n in nodes if n in self.nodes or n in self.shortNames]
+
+    def objExists(self, node):
+        self.callCounts["objExists"] += 1
+        return node in self.nodes or node in self.shortNames
+
+    def getVisibility(self, node):
+        self.callCounts["getVisibility"] += 1
+        return self.nodes[node]["v"]
+
+    def shapes(self, node):
+        self.callCounts["shapes"] += 1
+        return [n for n in self.children.get(node, []) if self.nodes[n]["shape"]]
+
+    def destinations(self, plug):
+        self.callCounts["destinations"] += 1
+        return list(self.connections.get(plug, []))
+
+    def selection(self):
+        self.callCounts["selection"] += 1
+        return list(self.selected)
+
+    def select(self, nodes, add=False, toggle=False, deselect=False):
+        self.callCounts["select"] += 1
+        nodes = self.longNames(nodes)
+        if toggle:
+            self.selected = [n for n in self.selected if n not in nodes] + [n for n in nodes if n not in self.selected]
+        elif deselect:
+            self.selected = [n for n in self.selected if n not in nodes]
+        elif add:
+            self.selected += [n for n in nodes if n not in self.selected]
+        else:
+            self.selected = nodes
+
+    def isPlayingBack(self):
+        return self.playingBack
+
+    def referenceNamespaces(self):
+        self.callCounts["referenceNamespaces"] += 1
+        return [ns for ns, isLoaded in self.references.items() if isLoaded]
+
+    def addCallback(self, node, func):
+        callbackId = len(self.callbacks) + 1
+        while callbackId in self.callbacks:
+            callbackId += 1
+
+        self.callbacks[callbackId] = (node, func)
+        return callbackId
+
+    def addEventCallback(self, event, func):
+        return self.addCallback(event, func)
+
+    def addConditionCallback(self, condition, func):
+        return self.addCallback(condition, func)
+
+    def removeScriptJob(self, jobId):
+        self.callbacks.pop(jobId, None)
+
+    def addAttributeChangedCallback(self, node, func):
+        self.callCounts["addAttributeChangedCallback"] += 1
+        if not self.objExists(node):
+            return None
+        return self.addCallback(self.longNames([node])[0], func)
+
+    def addSceneCallback(self, message, func):
+        return self.addCallback(message, func)
+
+    def removeCallback(self, callbackId):
+        self.callCounts["removeCallback"] += 1
+        self.callbacks.pop(callbackId, None)
+
+    def evalDeferred(self, func):
+        self.deferred.append(func)
+
+    def runDeferred(self):
+        deferred = self.deferred
+        self.deferred = []
+        for func in deferred:
+            func()
+
+    def openUndoChunk(self, name):
+        self.callCounts["openUndoChunk"] += 1
+
+    def closeUndoChunk(self):
+        self.callCounts["closeUndoChunk"] += 1
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+def timeit(func, repeats=Repeats):
+    times = []
+    for _ in range(repeats):
+        startTime = time.time()
+        func()
+        times.append(time.time() - startTime)
+
+    return {"min": min(times), "mean": sum(times) / len(times), "max": max(times), "repeats": repeats}
+
+def makeRig(maya, count, depth=6):
+    ''' root -> chain of depth groups -> count controls with shapes spread over the chain '''
+    parent = maya.createNode(Namespace+":root")
+    chain = [parent]
+    for i in range(depth):
+        chain.append(maya.createNode("%s:grp_%d"%(Namespace, i), chain[-1]))
+
+    for i in range(count):
+        node = maya.createNode("%s:ctrl_%d_control"%(Namespace, i), chain[i % len(chain)], visible=i % 7 != 0)
+        maya.createNode("%s:ctrl_%d_controlShape"%(Namespace, i), node, shape=True)
+
+    maya.references[Namespace] = True
+    return maya
+
+def makeProps(count):
+    props = []
+    for i in range(count):
+        props.append(VPControlProps(type=i % 3,
+                                    position=(i % 50 * 20, i / 50 * 20),
+                                    size=(15, 15),
+                                    color=(105, 191, 100),
+                                    label="c%d"%i if i % 4 == 0 else "",
+                                    points=[(0, 0), (10, 0), (5, 10)] if i % 3 == 0 else [],
+                                    control="ctrl_%d_control"%i,
+                                    command=""))
+    return props
+
+def installMayaStubs():
+    ''' minimal maya and shiboken2 modules, enough to import vptools '''
+    maya = types.ModuleType("maya")
+    cmds = types.ModuleType("maya.cmds")
+    cmds.workspace = lambda *args, **kwargs: tempfile.gettempdir()+"/vpbench/"
+
+    api = types.ModuleType("maya.api")
+    om = types.ModuleType("maya.api.OpenMaya")
+    apiUI = types.ModuleType("maya.OpenMayaUI")
+
+    maya.cmds = cmds
+    maya.api = api
+    maya.OpenMayaUI = apiUI
+    api.OpenMaya = om
+
+    sys.modules.update({"maya": maya,
+                        "maya.cmds": cmds,
+                        "maya.api": api,
+                        "maya.api.OpenMaya": om,
+                        "maya.OpenMayaUI": apiUI})
+
+    if "shiboken2" not in sys.modules:
+        try:
+            import shiboken2
+        except ImportError:
+            shiboken2 = types.ModuleType("shiboken2")
+            shiboken2.wrapInstance = lambda *args: None
+            sys.modules["shiboken2"] = shiboken2
+
+def benchFileIO(sizes, directory):
+    results = {}
+    for n in sizes:
+        path = "%s/layout_%d.xml"%(directory, n)
+        props = makeProps(n)
+
+        results["saveToFileList/%d"%n] = timeit(lambda: VPControlProps.saveToFileList(path, props))
+        results["loadFromFileList/%d"%n] = timeit(lambda: VPControlProps.loadFromFileList(path))
+
+        cache = vpcore.LayoutCache(directory+"/cache")
+        cache.loadFromFileList(path)
+        results["layoutCache.loadFromFileList/%d"%n] = timeit(lambda: cache.loadFromFileList(path))
+    return results
+
+def benchPresetIndex(sizes, directory):
+    results = {}
+    for n in sizes:
+        presetsDirectory = "%s/presets_%d"%(directory, n)
+        os.makedirs(presetsDirectory)
+        for i, props in enumerate(makeProps(n)):
+            props.saveToFile("%s/preset_%d.xml"%(presetsDirectory, i))
+
+        index = vpcore.PresetIndex()
+        results["PresetIndex.scanDirectory.build/%d"%n] = timeit(lambda: (index.entries.clear(), index.scanDirectory(presetsDirectory)), repeats=1)
+        results["PresetIndex.scanDirectory.unchanged/%d"%n] = timeit(lambda: index.scanDirectory(presetsDirectory))
+
+        def typeQuery():
+            index.invalidate()
+            for i in range(1, len("ctrl_1")+1):
+                index.search("ctrl_1"[:i])
+
+        results["PresetIndex.search.typing/%d"%n] = timeit(typeQuery)
+    return results
+
+def isActualVisible(maya, obj, checkShapes=True):
+    ''' the recursive walk updateControls did for every control before VisibilityResolver '''
+    obj = maya.longNames(obj)[0]
+
+    if checkShapes:
+        shapes = maya.shapes(obj)
+        if shapes and not any(maya.getVisibility(sh) for sh in shapes):
+            return False
+
+    if not maya.getVisibility(obj):
+        return False
+
+    parent = obj.rpartition("|")[0]
+    return isActualVisible(maya, parent, False) if parent else True
+
+def benchVisibility(sizes):
+    '''
+    isActualVisible is the old approach (objExists and a walk to the root for every control),
+    VisibilityResolver queries existence once per namespace and every node once per pass.
+    '''
+    results = {}
+    for n in sizes:
+        maya = makeRig(FakeMaya(), n)
+        controls = ["ctrl_%d_control"%i for i in range(n)]
+        resolver = VisibilityResolver(maya)
+
+        def perControl():
+            return [maya.objExists(Namespace+":"+ctrl) and isActualVisible(maya, Namespace+":"+ctrl) for ctrl in controls]
+
+        def resolve():
+            resolver.reset(Namespace)
+            return [resolver.isEnabled(ctrl) for ctrl in controls]
+
+        enabled = {}
+        for name, func in [("isActualVisible", perControl), ("VisibilityResolver", resolve)]:
+            maya.callCounts.clear()
+            enabled[name] = func()
+            callCounts = dict(maya.callCounts)
+
+            results["%s/%d"%(name, n)] = timeit(func)
+            results["%s/%d"%(name, n)]["mayaCalls"] = sum(callCounts.values())
+            results["%s/%d"%(name, n)]["mayaCallsByName"] = callCounts
+
+        if enabled["isActualVisible"] != enabled["VisibilityResolver"]:
+            raise AssertionError("VisibilityResolver disagrees with isActualVisible")
+
+    return results
+
+def rebuildWatchers(maya, callbackIds, nodes, attributes):
+    ''' the old selection change: kill every attribute callback and register new ones for the selection '''
+    for callbackId in callbackIds:
+        maya.removeCallback(callbackId)
+    del callbackIds[:]
+
+    for node in nodes:
+        for attr in attributes:
+            if maya.objExists(node):
+                callbackIds.append(maya.addAttributeChangedCallback(node, lambda plug: None))
+
+def benchSelectionChange(sizes, selectionSize=10, step=2):
+    '''
+    Latency of a selection change with the attribute watchers:
+    rebuild is the old approach (kill every callback and register new ones), registry only adds and removes the difference.
+    The selection slides over the controls, like shift-selecting neighbouring controls.
+    '''
+    attributes = ["ikfk", "v"]
+    results = {}
+    for n in sizes:
+        maya = makeRig(FakeMaya(), n)
+        controls = maya.longNames(["%s:ctrl_%d_control"%(Namespace, i) for i in range(n)])
+        selections = [controls[i:i+selectionSize] for i in range(0, max(n-selectionSize, 1), step)] + [[]]
+
+        callbackIds = []
+        rebuild = lambda nodes: rebuildWatchers(maya, callbackIds, nodes, attributes)
+
+        registry = AttributeWatcherRegistry(maya, attributes, lambda plug: None)
+
+        for name, func in [("rebuild", rebuild), ("registry", registry.watch)]:
+            def run():
+                for nodes in selections:
+                    func(nodes)
+
+            maya.callCounts.clear()
+            run()
+            calls = maya.callCounts["addAttributeChangedCallback"] + maya.callCounts["removeCallback"]
+
+            result = timeit(run)
+            for key in ["min", "mean", "max"]:
+                result[key] /= len(selections) # per selection change
+            result["callbackChanges"] = calls
+            results["selectionChange.%s/%d"%(name, n)] = result
+
+    return results
+
+def isActualVisiblePymel(core, obj, checkShapes=True):
+    ''' isActualVisible as vptools had it with pymel '''
+    obj = core.PyNode(obj)
+
+    visShapes = False
+    if checkShapes:
+        for sh in obj.getShapes():
+            visShapes = visShapes or sh.v.get()
+    else:
+        visShapes = True
+
+    if obj.getShapes() and not visShapes:
+        return False
+
+    if obj.hasAttr("visibility") and obj.v.get()==False:
+        return False
+
+    if obj.getParent():
+        return isActualVisiblePymel(core, obj.getParent(), False)
+    else:
+        return True
+
+def listCharacterReferencesPymel(core, markerControl):
+    ''' listCharacterReferences as vptools had it with pymel '''
+    namespaces = []
+    for ref in core.ls(type="reference"):
+        try:
+            isLoaded = core.referenceQuery(ref, isLoaded=True)
+        except:
+            continue
+
+        if not isLoaded:
+            continue
+
+        ns = core.referenceQuery(ref, shn=True, namespace=True)
+        if core.objExists(ns+":"+markerControl):
+            namespaces.append(ns)
+
+    return namespaces
+
+def makeMayaRig(cmds, count, directory, depth=6, markerControl="M_spine_fk_1_control"):
+    ''' makeRig in a real Maya scene, saved to a file and referenced under Namespace like a character '''
+    cmds.file(new=True, force=True)
+
+    parent = cmds.createNode("transform", name="root")
+    chain = [parent]
+    for i in range(depth):
+        chain.append(cmds.createNode("transform", name="grp_%d"%i, parent=chain[-1]))
+
+    cmds.createNode("transform", name=markerControl, parent=parent)
+    for i in range(count):
+        node = cmds.createNode("transform", name="ctrl_%d_control"%i, parent=chain[i % len(chain)])
+        cmds.createNode("nurbsCurve", name="ctrl_%d_controlShape"%i, parent=node)
+        cmds.addAttr(node, longName="ikfk", attributeType="double")
+        if i % 7 == 0:
+            cmds.setAttr(node+".visibility", False)
+
+    path = "%s/rig_%d.ma"%(directory, count)
+    cmds.file(rename=path)
+    cmds.file(save=True, type="mayaAscii", force=True)
+
+    cmds.file(new=True, force=True)
+    cmds.file(path, reference=True, namespace=Namespace)
+
+def benchPymel(sizes, directory, selectionSize=10):
+    '''
+    Per operation timing of the pymel code vptools had before MayaAccess and of MayaAccess, on the same rig.
+    Needs Maya (mayapy vpbench.py), it's skipped elsewhere. FakeMaya can't stand in here,
+    the difference is pymel's own overhead (PyNode construction, attribute wrapping).
+        import: import pymel.core in a fresh mayapy, MayaAccess imports only maya.cmds and OpenMaya 2
+        visibility: objExists and the pymel isActualVisible for every control vs VisibilityResolver
+        characterReferences: listCharacterReferences
+        select: a click on each of selectionSize controls
+        attributeWatchers: watch selectionSize controls and stop watching them (scriptJob vs MNodeMessage)
+    '''
+    try:
+        import maya.standalone
+        maya.standalone.initialize()
+        import maya.cmds as cmds
+        import pymel.core as core
+    except (ImportError, RuntimeError):
+        return {"pymel": {"skipped": "Maya is not available, run vpbench.py with mayapy"}}
+
+    markerControl = "M_spine_fk_1_control"
+    access = vpcore.MayaAccess()
+
+    code = "import sys, time, maya.standalone; maya.standalone.initialize(); startTime = time.time(); import pymel.core; sys.stdout.write(repr(time.time() - startTime))"
+    results = {"pymel.import": {"pymel": float(subprocess.check_output([sys.executable, "-c", code]))}}
+
+    for n in sizes:
+        makeMayaRig(cmds, n, directory, markerControl=markerControl)
+
+        controls = ["ctrl_%d_control"%i for i in range(n)]
+        nodes = [Namespace+":"+ctrl for ctrl in controls[:selectionSize]]
+        resolver = VisibilityResolver(access)
+
+        def visibilityPymel():
+            for ctrl in controls:
+                cmds.objExists(Namespace+":"+ctrl) and isActualVisiblePymel(core, Namespace+":"+ctrl)
+
+        def visibilityMayaAccess():
+            resolver.reset(Namespace)
+            for ctrl in controls:
+                resolver.isEnabled(ctrl)
+
+        def selectPymel():
+            for node in nodes:
+                core.select(node, add=True)
+
+        def selectMayaAccess():
+            for node in nodes:
+                access.select([node], add=True)
+
+        def watchersPymel():
+            jobIds = [core.scriptJob(ac=[node+"."+attr, lambda: None]) for node in nodes for attr in ["ikfk", "v"]]
+            for jobId in jobIds:
+                core.scriptJob(kill=jobId)
+
+        def watchersMayaAccess():
+            registry = AttributeWatcherRegistry(access, ["ikfk", "v"], lambda plug: None)
+            registry.watch(nodes)
+            registry.clear()
+
+        operations = [("visibility", visibilityPymel, visibilityMayaAccess),
+                      ("characterReferences", lambda: listCharacterReferencesPymel(core, markerControl),
+                                              lambda: [ns for ns in access.referenceNamespaces() if access.objExists(ns+":"+markerControl)]),
+                      ("select", selectPymel, selectMayaAccess),
+                      ("attributeWatchers", watchersPymel, watchersMayaAccess)]
+
+        for name, pymelFunc, mayaAccessFunc in operations:
+            result = {}
+            for layer, func in [("pymel", pymelFunc), ("mayaAccess", mayaAccessFunc)]:
+                try:
+                    result[layer] = timeit(func)
+                except RuntimeError as e: # scriptJob isn't available in every batch session
+                    result[layer] = {"skipped": str(e)}
+
+            results["pymel.%s/%d"%(name, n)] = result
+
+    return results
+
+def checkAttributeWatchers():
+    ''' a visibility change of a watched node reaches the callback, FakeMaya reports it by its long name '''
+    maya = makeRig(FakeMaya(), 10)
+    node = maya.longNames(Namespace+":ctrl_1_control")[0]
+
+    plugs = []
+    registry = AttributeWatcherRegistry(maya, ["ikfk", "v"], plugs.append)
+    registry.watch([node])
+    maya.setVisibility(node, False)
+
+    if not plugs:
+        raise AssertionError("visibility change of a watched node was dropped")
+
+def checkCore():
+    ''' regression checks of vpcore, a failing check raises AssertionError '''
+    checks = [checkAttributeWatchers]
+    for check in checks:
+        check()
+
+    return [check.__name__ for check in checks]
+
+def benchQt(sizes, directory):
+    try:
+        from PySide2.QtCore import Qt, QThreadPool, QPointF
+        from PySide2.QtGui import QImage, QPainter
+        from PySide2.QtWidgets import QApplication, QWidget, QComboBox
+    except ImportError:
+        return {"skipped": "PySide2 is not available"}
+
+    installMayaStubs()
+    import vptools
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = {"checks": checkQt()}
+
+    vptools.VPToolsDirectory = os.path.dirname(os.path.abspath(__file__))
+    vptools.layoutCache = vpcore.LayoutCache(directory+"/cache")
+
+    for n in sorted(set(sizes) | set([DragSceneSize])):
+        vptools.mayaAccess = makeRig(FakeMaya(), n)
+
+        window = QWidget()
+        window.namespaceWidget = QComboBox()
+        window.namespaceWidget.addItem(Namespace)
+
+        scene = vptools.VPToolsScene(window)
+        window.vptoolsScene = scene
+        view = vptools.VPToolsView(scene, mainWindow=window)
+
+        path = "%s/layout_%d.xml"%(directory, n)
+        VPControlProps.saveToFileList(path, makeProps(n))
+
+        def importFromFile():
+            scene.clear()
+            scene.importFromFile(path)
+
+        results["VPToolsScene.importFromFile/%d"%n] = timeit(importFromFile, repeats=3)
+        results["VPToolsScene.updateControls/%d"%n] = timeit(scene.updateControls)
+
+        image = QImage(1920, 1080, QImage.Format_ARGB32_Premultiplied)
+        items = scene.listControls()
+
+        def paintFrame():
+            painter = QPainter(image)
+            scene.render(painter)
+            painter.end()
+
+        def hoverFrame():
+            for item in items[:50]:
+                item.isHover = not item.isHover
+            paintFrame()
+
+        def dragFrame():
+            scene.beginSelectionMove(QPointF(0, 0), items[0])
+            for x in range(1, 11):
+                scene.moveSelection(QPointF(x, 0))
+            scene.endSelectionMove()
+            paintFrame()
+
+        for item in items:
+            item.setSelected(True)
+
+        results["VPcontrol.paint.hover/%d"%n] = timeit(hoverFrame)
+        results["VPcontrol.paint.drag/%d"%n] = timeit(dragFrame)
+
+        def dragFps(cached):
+            ''' frames per second while 10 selected controls are dragged across the scene, one paint per mouse move '''
+            scene.clearSelection()
+            for item in items[:10]:
+                item.setSelected(True)
+
+            scene.beginSelectionMove(QPointF(0, 0), items[0])
+            startTime = time.time()
+            for frame in range(1, DragFrames+1):
+                if not cached:
+                    vptools.VPcontrol.renderCache.clear()
+                scene.moveSelection(QPointF(frame*5, frame*2))
+                paintFrame()
+            elapsed = time.time() - startTime
+            scene.endSelectionMove()
+
+            return DragFrames / max(elapsed, 1e-6)
+
+        results["VPcontrol.drag.fps/%d"%n] = {"cached": dragFps(True), "uncached": dragFps(False)}
+
+    vptools.controlLibrary = vptools.ControlLibrary()
+    browser = vptools.ControlsBrowser()
+
+    def browserUpdate():
+        browser.update()
+        QThreadPool.globalInstance().waitForDone()
+        app.processEvents()
+
+    results["ControlsBrowser.update"] = timeit(browserUpdate)
+
+    for n in StartupSizes:
+        results.update(benchStartup(n, directory))
+
+    return results
+
+def benchStartup(n, directory, repeats=3):
+    '''
+    The window's loading path (layout in chunks, then visibility in time slices) until it's interactive.
+    cold parses the XML and writes the layout cache, warm loads the cache written by the previous run.
+    Must run after benchQt has set up QApplication and the Maya stubs.
+    '''
+    from PySide2.QtCore import QEventLoop
+    from PySide2.QtWidgets import QWidget, QComboBox
+    import vptools
+
+    vptools.mayaAccess = makeRig(FakeMaya(), n)
+
+    path = "%s/startup_%d.xml"%(directory, n)
+    VPControlProps.saveToFileList(path, makeProps(n))
+
+    cacheDirectory = directory+"/startupCache"
+    vptools.layoutCache = vpcore.LayoutCache(cacheDirectory)
+
+    def startup():
+        window = QWidget()
+        window.namespaceWidget = QComboBox()
+        window.namespaceWidget.addItem(Namespace)
+
+        scene = vptools.VPToolsScene(window)
+        window.vptoolsScene = scene
+        view = vptools.VPToolsView(scene, mainWindow=window)
+
+        loop = QEventLoop()
+        def loadVisibility():
+            scene.updateControlsAsync().finished.connect(loop.quit)
+
+        startTime = time.time()
+        scene.importFromFileAsync(path).finished.connect(loadVisibility)
+        loop.exec_()
+        return time.time() - startTime
+
+    results = {}
+    for name, isCold in [("cold", True), ("warm", False)]:
+        times = []
+        for _ in range(repeats):
+            if isCold and os.path.exists(cacheDirectory):
+                shutil.rmtree(cacheDirectory)
+            times.append(startup())
+
+        results["startup.%s/%d"%(name, n)] = {"min": min(times), "mean": sum(times) / len(times), "max": max(times), "repeats": repeats}
+
+    return results
+
+def makeScene():
+    ''' scene and view with a stand-in main window, enough for VPToolsScene outside of Maya '''
+    from PySide2.QtWidgets import QWidget, QComboBox
+    import vptools
+
+    window = QWidget()
+    window.namespaceWidget = QComboBox()
+    window.namespaceWidget.addItem(Namespace)
+
+    scene = vptools.VPToolsScene(window)
+    window.vptoolsScene = scene
+    view = vptools.VPToolsView(scene, mainWindow=window)
+    return window, scene, view
+
+def checkSelectionMove():
+    ''' dragged items must stay owned by the scene once the undo stack and the indices drop them '''
+    from PySide2.QtCore import QPointF
+    import vptools
+
+    vptools.mayaAccess = makeRig(FakeMaya(), 20)
+    window, scene, view = makeScene()
+    for props in makeProps(20):
+        scene.addControl(props)
+    scene.updateControls() # fills the dependency index and controlsByNode
+
+    items = scene.listControls()
+    for item in items[:5]:
+        item.setSelected(True)
+
+    scene.beginSelectionMove(QPointF(0, 0), items[0])
+    scene.moveSelection(QPointF(10, 5))
+    scene.endSelectionMove()
+
+    del items, item
+    scene.undoStack.clear()
+    scene.dependencyIndex.clear()
+    scene.controlsByNode = {}
+    gc.collect()
+
+    count = len(scene.listControls())
+    if count != 20:
+        raise AssertionError("%d of 20 controls are left after a selection move"%count)
+
+def checkCommandQueue():
+    ''' click A, shift-click B, click A: the merged click on A runs last and only A stays selected '''
+    import vptools
+
+    vptools.mayaAccess = maya = makeRig(FakeMaya(), 10)
+    queue = vptools.CommandQueue()
+    a, b = [VPControlProps(control="ctrl_%d_control"%i, command="") for i in range(2)]
+
+    for props, shift in [(a, False), (b, True), (a, False)]:
+        queue.push(id(props), props.control, lambda props=props, shift=shift: vptools.VPcontrol.execute(props, Namespace+":", shift))
+    maya.runDeferred()
+
+    if maya.selected != maya.longNames([Namespace+":"+a.control]):
+        raise AssertionError("merged clicks ran out of order, selected: %s"%maya.selected)
+
+def checkMarquee():
+    ''' in animation mode a press on empty space starts a marquee, a press on a proxy widget doesn't '''
+    from PySide2.QtCore import Qt, QEvent, QPointF
+    from PySide2.QtWidgets import QGraphicsSceneMouseEvent, QPushButton
+    import vptools
+
+    vptools.mayaAccess = makeRig(FakeMaya(), 10)
+    window, scene, view = makeScene()
+
+    proxy = scene.addWidget(QPushButton("VPTools"))
+    proxy.setPos(0, 0)
+
+    def press(pos):
+        event = QGraphicsSceneMouseEvent(QEvent.GraphicsSceneMousePress)
+        event.setScenePos(pos)
+        event.setButton(Qt.LeftButton)
+        event.setButtons(Qt.LeftButton)
+        scene.mousePressEvent(event)
+
+        isDragging = scene.isDragging
+        scene.isDragging = False
+        return isDragging
+
+    if press(proxy.mapToScene(proxy.boundingRect().center())):
+        raise AssertionError("a press on a proxy widget started a marquee")
+
+    if not press(QPointF(proxy.sceneBoundingRect().right()+100, proxy.sceneBoundingRect().bottom()+100)):
+        raise AssertionError("a press on empty space didn't start a marquee")
+
+def checkQt():
+    ''' regression checks of the Qt layer, a failing check raises AssertionError '''
+    checks = [checkSelectionMove, checkCommandQueue, checkMarquee]
+    for check in checks:
+        check()
+
+    return [check.__name__ for check in checks]
+
+def benchImport(repeats=Repeats):
+    ''' import time of vpcore in a fresh interpreter, it must stay free of Maya and Qt imports '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    code = "import sys, time; startTime = time.time(); import vpcore; sys.stdout.write(repr(time.time() - startTime))"
+
+    times = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=directory)
+        times.append(float(output))
+
+    return {"import vpcore": {"min": min(times), "mean": sum(times) / len(times), "max": max(times), "repeats": repeats}}
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main(args):
+    output = None
+    sizes = [10, 100, 1000, 10000]
+
+    if "--output" in args:
+        output = args[args.index("--output")+1]
+    if "--sizes" in args:
+        sizes = [int(v) for v in args[args.index("--sizes")+1].split(",")]
+
+    directory = tempfile.mkdtemp(prefix="vpbench")
+    try:
+        results = {"checks": checkCore()}
+        results.update(benchImport())
+        results.update(benchFileIO(sizes, directory))
+        results.update(benchPresetIndex(sizes, directory))
+        results.update(benchVisibility(sizes))
+        results.update(benchSelectionChange(sizes))
+        results.update(benchPymel(sizes, directory))
+        results["qt"] = benchQt(sizes, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {"revision": gitRevision(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": results}
+
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print text
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
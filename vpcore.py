@@ -0,0 +1,1443 @@
+import os
+import re
+import time
+import json
+import bisect
+import glob
+import marshal
+import hashlib
+import tokenize
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict
+
+def replaceFile(src, dst):
+    ''' renames src to dst atomically, dst is replaced if it exists '''
+    if os.name == "nt": # os.rename doesn't replace on Windows
+        import ctypes
+        MoveFileReplaceExisting = 0x1
+        MoveFileWriteThrough = 0x8
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(src), unicode(dst), MoveFileReplaceExisting | MoveFileWriteThrough):
+            raise ctypes.WinError()
+    else:
+        os.rename(src, dst)
+
+class MayaAccess(object):
+    '''
+    Maya operations used by vptools, implemented with maya.cmds and OpenMaya 2 (no pymel).
+    Maya is imported on construction. vpbench.FakeMaya implements the same methods without Maya.
+    '''
+    def __init__(self):
+        import maya.cmds as cmds
+        import maya.api.OpenMaya as om
+
+        self.cmds = cmds
+        self.om = om
+
+    def workspaceDirectory(self):
+        return self.cmds.workspace(q=True, rd=True)
+
+    def namespaceNodes(self, namespace):
+        return self.cmds.ls(namespace+":*", long=True) or []
+
+    def longNames(self, nodes, dagOnly=False):
+        if dagOnly:
+            return self.cmds.ls(nodes, long=True, dag=True) or []
+        return self.cmds.ls(nodes, long=True) or []
+
+    def objExists(self, node):
+        return self.cmds.objExists(node)
+
+    def getVisibility(self, node):
+        try:
+            return bool(self.cmds.getAttr(node+".visibility"))
+        except ValueError:
+            return True
+
+    def shapes(self, node):
+        return self.cmds.listRelatives(node, shapes=True, fullPath=True) or []
+
+    def destinations(self, plug):
+        return self.cmds.listConnections(plug, source=False, destination=True) or []
+
+    def selection(self):
+        return self.cmds.ls(sl=True, long=True) or []
+
+    def select(self, nodes, add=False, toggle=False, deselect=False):
+        if add or toggle or deselect:
+            if nodes:
+                self.cmds.select(nodes, add=add, toggle=toggle, deselect=deselect)
+        elif nodes:
+            self.cmds.select(nodes, replace=True)
+        else:
+            self.cmds.select(clear=True)
+
+    def isPlayingBack(self):
+        return self.cmds.play(q=True, state=True)
+
+    def referenceNamespaces(self):
+        ''' namespaces of the loaded references '''
+        namespaces = []
+        for ref in self.cmds.ls(type="reference") or []:
+            try:
+                if not self.cmds.referenceQuery(ref, isLoaded=True):
+                    continue
+                namespaces.append(self.cmds.referenceQuery(ref, shortName=True, namespace=True))
+            except RuntimeError:
+                continue
+        return namespaces
+
+    def addEventCallback(self, event, func):
+        return self.cmds.scriptJob(e=[event, func])
+
+    def addConditionCallback(self, condition, func):
+        return self.cmds.scriptJob(cc=[condition, func])
+
+    def removeScriptJob(self, jobId):
+        if jobId >= 0 and self.cmds.scriptJob(exists=jobId):
+            self.cmds.scriptJob(kill=jobId, force=True)
+
+    def addAttributeChangedCallback(self, node, func):
+        '''
+        func(plug) is called with "node.attr" when an attribute of node changes, returns None if node doesn't exist.
+        Besides setAttr, driven attributes (animation, expressions, connections) are reported when they are evaluated,
+        and attributes are reported when they get connected or disconnected.
+        '''
+        try:
+            sel = self.om.MSelectionList()
+            sel.add(node)
+            mobj = sel.getDependNode(0)
+        except RuntimeError:
+            return None
+
+        messages = self.om.MNodeMessage
+        connectionChanged = messages.kConnectionMade | messages.kConnectionBroken
+
+        def attributeChangedCallback(msg, plug, otherPlug, clientData):
+            if msg & messages.kAttributeSet or msg & connectionChanged:
+                func(plug.partialName(includeNodeName=True)) # node.v, short attribute names
+
+            elif msg & messages.kAttributeEval and plug.isDestination:
+                func(plug.partialName(includeNodeName=True))
+
+        return self.om.MNodeMessage.addAttributeChangedCallback(mobj, attributeChangedCallback)
+
+    def addSceneCallback(self, message, func):
+        return self.om.MSceneMessage.addCallback(getattr(self.om.MSceneMessage, message), lambda *args: func())
+
+    def removeCallback(self, callbackId):
+        self.om.MMessage.removeCallback(callbackId)
+
+    def evalDeferred(self, func):
+        self.cmds.evalDeferred(func, lowestPriority=True)
+
+    def openUndoChunk(self, name):
+        self.cmds.undoInfo(openChunk=True, chunkName=name)
+
+    def closeUndoChunk(self):
+        self.cmds.undoInfo(closeChunk=True)
+
+    def warning(self, message):
+        self.cmds.warning(message)
+
+def color2hex(color):
+    return "#%.2x%.2x%.2x"%color
+
+def point2str(p):
+    return "%d %d"%p
+
+def points2str(points):
+    return ",".join([point2str(p) for p in points])
+
+def text2points(text):
+    if not text:
+        return []
+    
+    points = []
+    for pd in text.split(","):
+        x,y = pd.split()
+        x = int(x.strip())
+        y = int(y.strip())
+        points.append((x,y))
+
+    return points
+
+class VPControlProps(object):
+    __slots__ = ("type",
+                 "position",
+                 "rotation",
+                 "invert",
+                 "size",
+                 "textColor",
+                 "color",
+                 "gradient",
+                 "roundRadius",
+                 "label",
+                 "pointsBuffer",
+                 "control",
+                 "command",
+                 "geometryVersion",
+                 "scaledPointsCache",
+                 "boundingRectCache")
+
+    PolygonType = 0
+    EllipseType = 1
+    RectType = 2
+
+    Margin = 2
+
+    GeometryAttributes = ("type", "size", "points")
+    SharedAttributes = ("size", "color", "textColor")
+    SharedValues = {} # interned size and color tuples, cleared when it grows past MaxSharedValues
+    MaxSharedValues = 4096
+
+    MinPositionX = 0
+    MinPositionY = 0
+
+    def __init__(self,
+                 type=RectType,
+                 position=(0, 0),
+                 rotation=0,
+                 invert=False,
+                 size=(10, 10),
+                 textColor=(0, 0, 0),
+                 color=(0, 0, 0),
+                 roundRadius=25,
+                 gradient=True,
+                 label="",
+                 points=[],
+                 control="",
+                 command="print \"hello world\""):
+
+        self.geometryVersion = 0
+        self.type = type
+
+        self.position = position
+        self.rotation = rotation
+        self.invert = invert
+        self.size = size
+
+        self.textColor = textColor
+        self.color = color
+        self.gradient = gradient
+        self.roundRadius = roundRadius
+
+        self.label = label
+
+        self.points = list(points)
+
+        self.control = control
+        self.command = command
+
+    def copy(self):
+        s = VPControlProps()
+        s.type = self.type
+
+        s.position = tuple(self.position)
+        s.rotation = self.rotation
+        s.invert = self.invert
+        s.size = tuple(self.size)
+
+        s.textColor = self.textColor
+        s.color = self.color
+        s.gradient = self.gradient
+        s.roundRadius = self.roundRadius
+
+        s.label = self.label
+
+        s.points = list(self.points)
+
+        s.control = self.control
+        s.command = self.command
+        return s        
+    
+    @staticmethod
+    def share(value):
+        ''' one tuple object per distinct value, interactive edits can't grow the table without bound '''
+        shared = VPControlProps.SharedValues
+        existing = shared.get(value)
+        if existing is not None:
+            return existing
+
+        if len(shared) >= VPControlProps.MaxSharedValues:
+            shared.clear() # props keep their tuples, only later values stop being shared with them
+
+        shared[value] = value
+        return value
+
+    def __setattr__(self, name, value):
+        if name in VPControlProps.SharedAttributes:
+            value = VPControlProps.share(tuple(value))
+
+        object.__setattr__(self, name, value)
+
+        if name in VPControlProps.GeometryAttributes:
+            self.invalidateGeometry()
+
+    @property
+    def points(self):
+        buf = self.pointsBuffer
+        return zip(buf[0::2], buf[1::2])
+
+    @points.setter
+    def points(self, points):
+        buf = array("i")
+        for x, y in points:
+            buf.append(int(x))
+            buf.append(int(y))
+        self.pointsBuffer = buf
+
+    def invalidateGeometry(self):
+        self.scaledPointsCache = None
+        self.boundingRectCache = None
+        self.geometryVersion += 1
+
+    def getScaledPoints(self):
+        if self.scaledPointsCache is None:
+            maxX, maxY = 0.001, 0.001
+            for x,y in self.points:
+                if x > maxX:
+                    maxX = x
+                if y > maxY:
+                    maxY = y
+
+            scaledPoints = []
+            for x,y in self.points:
+                scaledX = x / float(maxX) * self.size[0]
+                scaledY = y / float(maxY) * self.size[1]
+
+                scaledX += VPControlProps.Margin
+                scaledY += VPControlProps.Margin
+
+                scaledPoints.append((scaledX, scaledY))
+
+            self.scaledPointsCache = scaledPoints
+
+        return self.scaledPointsCache
+
+    def boundingRect(self):
+        if self.boundingRectCache is None:
+            if self.type == VPControlProps.PolygonType:
+                w = 0
+                h = 0
+                for p in self.getScaledPoints():
+                    if p[0] > w:
+                        w = p[0]
+
+                    if p[1] > h:
+                        h = p[1]
+
+                self.boundingRectCache = (0,0,w+VPControlProps.Margin,h+VPControlProps.Margin)
+
+            else:
+                self.boundingRectCache = (0,0,self.size[0] + VPControlProps.Margin, self.size[1] + VPControlProps.Margin)
+
+        return self.boundingRectCache
+
+    def toXml(self):
+        return "\n".join(["".join(["<control ",
+                                   " ".join(["type=\"{type}\"",
+                                             "position=\"{x},{y}\"",
+                                             "rotation=\"{rotation}\"",
+                                             "invert=\"{invert}\"",
+                                             "size=\"{w},{h}\"",
+                                             "label=\"{label}\"",
+                                             "color=\"{color}\"",
+                                             "gradient=\"{gradient}\"",
+                                             "textColor=\"{textColor}\"",
+                                             "roundRadius=\"{roundRadius}\"",
+                                             "points=\"{points}\"",
+                                             "control=\"{control}\""]).format(
+                                                 type=self.type,
+                                                 x=int(self.position[0]),
+                                                 y=int(self.position[1]),
+                                                 rotation=int(self.rotation),
+                                                 invert=int(self.invert),
+                                                 w=int(self.size[0]),
+                                                 h=int(self.size[1]),
+                                                 label=self.label,
+                                                 roundRadius=int(self.roundRadius),
+                                                 color="%d,%d,%d"%self.color,
+                                                 gradient=int(self.gradient),
+                                                 textColor="%d,%d,%d"%self.textColor,
+                                                 points=points2str(self.points),
+                                                 control=self.control),
+                                   ">"]),
+                          "\n".join(["<command>",
+                                     "<![CDATA[%s]]>"%self.command.strip(),
+                                     "</command>"]),
+                          "</control>"])
+
+    def saveToFile(self, path):
+        with open(path, "w") as f:
+            f.write(self.toXml())
+
+    @staticmethod
+    def saveToFileList(path, props):
+        xmls = []
+        for p in props:
+            xmls.append(p.toXml())
+
+        with open(path, "w") as f:
+            f.write("\n".join(["<props>",
+                               "\n".join(xmls),
+                               "</props>"]))
+
+
+    @staticmethod
+    def fromXmlElement(element):
+        s = VPControlProps()
+        s.type = int(element.get("type",0))
+        s.position = tuple([int(v) for v in element.get("position", (0,0)).split(",")])
+        s.rotation = int(element.get("rotation", 0))
+        s.invert = bool(int(element.get("invert", False)))
+        s.size = tuple([int(v) for v in element.get("size", (0,0)).split(",")])
+        s.label = element.get("label", "")
+        s.color = tuple([int(v) for v in element.get("color").split(",")])
+        s.textColor = tuple([int(v) for v in element.get("textColor").split(",")])
+        s.gradient = bool(int(element.get("gradient")))
+        s.roundRadius = int(element.get("roundRadius", 0))
+        if element.get("points"):
+            s.points = [(int(x), int(y)) for x,y in [p.split() for p in element.get("points").split(",")]]
+
+        s.control = element.get("control","")
+        s.command = element.findtext("command","").strip()
+
+        VPControlProps.updateMinPosition(s.position)
+        return s
+
+    @staticmethod
+    def updateMinPosition(position):
+        if position[0] < VPControlProps.MinPositionX:
+            VPControlProps.MinPositionX = position[0]
+        if position[1] < VPControlProps.MinPositionY:
+            VPControlProps.MinPositionY = position[1]            
+
+    def toTuple(self):
+        return (self.type,
+                tuple(self.position),
+                self.rotation,
+                self.invert,
+                self.size,
+                self.label,
+                self.color,
+                self.textColor,
+                self.gradient,
+                self.roundRadius,
+                tuple(self.pointsBuffer),
+                self.control,
+                self.command)
+
+    @staticmethod
+    def fromTuple(data):
+        (type, position, rotation, invert, size, label, color,
+         textColor, gradient, roundRadius, points, control, command) = data
+
+        # bypass __setattr__, geometry is invalidated once below
+        s = VPControlProps.__new__(VPControlProps)
+        setSlot = object.__setattr__
+        share = VPControlProps.share
+
+        setSlot(s, "type", type)
+        setSlot(s, "position", position)
+        setSlot(s, "rotation", rotation)
+        setSlot(s, "invert", invert)
+        setSlot(s, "size", share(size))
+        setSlot(s, "label", label)
+        setSlot(s, "color", share(color))
+        setSlot(s, "textColor", share(textColor))
+        setSlot(s, "gradient", gradient)
+        setSlot(s, "roundRadius", roundRadius)
+        setSlot(s, "pointsBuffer", array("i", points))
+        setSlot(s, "control", control)
+        setSlot(s, "command", command)
+        setSlot(s, "geometryVersion", 0)
+        s.invalidateGeometry()
+
+        VPControlProps.updateMinPosition(position)
+        return s
+
+    @staticmethod
+    def fromXml(text):
+        root = ET.fromstring(text).getroot()
+        return VPControlProps.fromXmlElement(root)
+
+    @staticmethod
+    def loadFromFileList(path):
+        return list(VPControlProps.iterFromFileList(path))
+
+    @staticmethod
+    def iterFromFileList(path):
+        context = ET.iterparse(path, events=("start", "end"))
+        _, root = next(context)
+
+        for event, element in context:
+            if event == "end" and element.tag == "control":
+                yield VPControlProps.fromXmlElement(element)
+                root.clear() # drop parsed controls, memory stays flat
+
+    @staticmethod
+    def loadFromFile(path):
+        root = ET.parse(path).getroot()
+        return VPControlProps.fromXmlElement(root)
+
+    @staticmethod
+    def listControls(directory):
+        files = []
+        for f in glob.glob(directory+"/controls/*.xml"):
+            files.append(f)
+        return files
+
+class LayoutCache(object):
+    '''
+    Parsed layouts stored with marshal in a cache directory, one file per layout.
+    A cache file is used when the layout's size and mtime match, or when its content hash matches.
+    Stale or corrupt cache files fall back to parsing the xml.
+    '''
+    Version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def cachePath(self, path):
+        name = hashlib.md5(os.path.normcase(os.path.abspath(path)).encode("utf-8")).hexdigest()
+        return "%s/%s.bin"%(self.directory, name)
+
+    @staticmethod
+    def fileDigest(path):
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def read(self, path):
+        try:
+            with open(self.cachePath(path), "rb") as f:
+                header, data = marshal.load(f)
+        except Exception:
+            return None, None
+
+        if not isinstance(header, tuple) or len(header) != 4 or header[0] != LayoutCache.Version:
+            return None, None
+
+        return header, data
+
+    def write(self, path, props, digest=None):
+        st = os.stat(path)
+        header = (LayoutCache.Version, st.st_size, st.st_mtime, digest or LayoutCache.fileDigest(path))
+        data = [p.toTuple() for p in props]
+
+        cachePath = self.cachePath(path)
+        tmpPath = cachePath + ".tmp"
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            with open(tmpPath, "wb") as f:
+                marshal.dump((header, data), f)
+
+            replaceFile(tmpPath, cachePath)
+
+        except (IOError, OSError, ValueError):
+            pass
+
+    def loadFromFileList(self, path):
+        return list(self.iterFromFileList(path))
+
+    def iterFromFileList(self, path):
+        ''' cached props when the cache is valid, streamed xml otherwise '''
+        props = self.readProps(path)
+        if props is not None:
+            for p in props:
+                yield p
+            return
+
+        props = []
+        for p in VPControlProps.iterFromFileList(path):
+            props.append(p)
+            yield p
+
+        self.write(path, props)
+
+    def readProps(self, path):
+        st = os.stat(path)
+        header, data = self.read(path)
+        if not header:
+            return None
+
+        _, size, mtime, digest = header
+        if size == st.st_size and mtime == st.st_mtime:
+            return self.fromData(data)
+
+        fileDigest = LayoutCache.fileDigest(path)
+        if digest != fileDigest:
+            return None
+
+        props = self.fromData(data)
+        if props is not None:
+            self.write(path, props, fileDigest)
+        return props
+
+    def fromData(self, data):
+        try:
+            return [VPControlProps.fromTuple(d) for d in data]
+        except Exception:
+            return None
+
+class EditJournal(object):
+    '''
+    Append-only journal of control edits for a layout file, one json record per line:
+        ["add", id, props tuple], ["set", id, attr, value], ["remove", id]
+    Controls are identified by their order in the layout, added controls get the following ids.
+    A journal is named by the generation of the layout it applies to (user.xml -> user.<generation>.journal),
+    compaction writes the layout with the next generation, so a journal is never applied twice.
+    '''
+    def __init__(self, layoutPath):
+        self.layoutPath = layoutPath
+        self.generation = 0
+        self.count = 0 # records in the current journal
+        self.digest = None # md5 of the last written layout
+        self.file = None
+
+    def journalPath(self, generation):
+        return "%s.%d.journal"%(os.path.splitext(self.layoutPath)[0], generation)
+
+    def listJournals(self):
+        ''' [(generation, path)] sorted by generation '''
+        prefix = os.path.splitext(self.layoutPath)[0]
+        pattern = re.compile(re.escape(os.path.basename(prefix)) + r"\.(\d+)\.journal$")
+
+        journals = []
+        for path in glob.glob(prefix+".*.journal"):
+            m = pattern.match(os.path.basename(path))
+            if m:
+                journals.append((int(m.group(1)), path))
+
+        return sorted(journals)
+
+    @staticmethod
+    def layoutGeneration(path):
+        try:
+            for _, element in ET.iterparse(path, events=("start",)):
+                return int(element.get("generation", 0))
+        except (IOError, ValueError, ET.ParseError):
+            pass
+        return 0
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        ''' appends records with a single flush '''
+        if self.file is None:
+            self.file = open(self.journalPath(self.generation), "a")
+
+        self.file.write("".join([json.dumps(record)+"\n" for record in records]))
+        self.file.flush()
+        self.count += len(records)
+
+    def add(self, controlId, props):
+        self.append(["add", controlId, props.toTuple()])
+
+    def set(self, controlId, attr, value):
+        self.append(["set", controlId, attr, value])
+
+    def setMany(self, changes, attr):
+        ''' changes are [(id, value)] '''
+        self.extend([["set", controlId, attr, value] for controlId, value in changes])
+
+    def remove(self, controlId):
+        self.append(["remove", controlId])
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        ''' next records go to the journal of the next generation, returns the generation of the finished journal '''
+        self.close()
+        self.generation += 1
+        self.count = 0
+        return self.generation - 1
+
+    @staticmethod
+    def replay(path, props):
+        ''' returns props with the journal applied, in id order '''
+        controls = dict(enumerate(props))
+
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError: # torn write of the last record
+                    break
+
+                op, controlId = record[0], record[1]
+
+                if op == "add":
+                    controls[controlId] = VPControlProps.fromTuple(tuple([tuple(v) if isinstance(v, list) else v for v in record[2]]))
+
+                elif op == "set" and controlId in controls:
+                    attr, value = record[2], record[3]
+                    if isinstance(value, list) and attr != "points":
+                        value = tuple(value)
+                    setattr(controls[controlId], attr, value)
+
+                elif op == "remove":
+                    controls.pop(controlId, None)
+
+        return [controls[i] for i in sorted(controls)]
+
+    def restoreTemporary(self):
+        ''' a complete temporary layout left without a layout by a crash becomes the layout '''
+        tmpPath = self.layoutPath + ".tmp"
+        if os.path.exists(self.layoutPath) or not os.path.exists(tmpPath):
+            return False
+
+        try:
+            ET.parse(tmpPath)
+        except (IOError, ET.ParseError): # the crash was while writing it
+            return False
+
+        replaceFile(tmpPath, self.layoutPath)
+        return True
+
+    def recover(self, defaultPath):
+        '''
+        Applies the journals left by a crash to the layout, or to defaultPath when there's no layout, and writes the layout.
+        Sets the generation of the session, returns True if the layout was written.
+        '''
+        self.restoreTemporary()
+
+        basePath = defaultPath
+        generation = 0
+        if os.path.exists(self.layoutPath):
+            basePath = self.layoutPath
+            generation = EditJournal.layoutGeneration(basePath)
+
+        journals = []
+        for g, path in self.listJournals():
+            if g >= generation:
+                journals.append((g, path))
+            else:
+                os.remove(path) # already in the layout
+
+        self.generation = generation
+        if not journals:
+            return False
+
+        props = VPControlProps.loadFromFileList(basePath)
+        for _, path in journals:
+            props = EditJournal.replay(path, props)
+
+        self.generation = journals[-1][0] + 1
+        self.write(props, self.generation)
+
+        for _, path in journals:
+            os.remove(path)
+        return True
+
+    def write(self, props, generation):
+        ''' writes the layout atomically, skipped when the content didn't change, returns True if written '''
+        body = "\n".join([p.toXml() for p in props])
+        digest = hashlib.md5(body.encode("utf-8")).hexdigest()
+        if digest == self.digest:
+            return False
+
+        tmpPath = self.layoutPath + ".tmp"
+        with open(tmpPath, "w") as f:
+            f.write("<props generation=\"%d\">\n%s\n</props>"%(generation, body))
+
+        replaceFile(tmpPath, self.layoutPath)
+
+        self.digest = digest
+        return True
+
+    def compact(self, props, generation):
+        '''
+        Writes props (the layout with the journal of generation applied) and removes the applied journals.
+        Runs on a worker thread, props must not be shared with the scene.
+        '''
+        written = self.write(props, generation + 1)
+
+        for g, path in self.listJournals():
+            if g <= generation:
+                os.remove(path)
+
+        return written
+
+class UndoStack(object):
+    '''
+    Undo steps made of deltas (op, key, attr, old, new), ops are "set", "add" and "remove".
+    Pushing the mergeKey of the previous push within MergeInterval seconds merges the deltas into its step,
+    set deltas of the same key and attr keep the first old value. At most MaxSteps steps are kept.
+    '''
+    MaxSteps = 200
+    MergeInterval = 1.0
+
+    def __init__(self):
+        self.steps = []
+        self.index = 0 # steps before index are done
+        self.mergeKey = None
+        self.mergeTime = 0.0
+
+    def clear(self):
+        self.steps = []
+        self.index = 0
+        self.mergeKey = None
+
+    def push(self, deltas, mergeKey=None):
+        if not deltas:
+            return
+
+        del self.steps[self.index:]
+
+        now = time.time()
+        if mergeKey is not None and mergeKey == self.mergeKey and now - self.mergeTime < UndoStack.MergeInterval and self.steps:
+            UndoStack.merge(self.steps[-1], deltas)
+        else:
+            self.steps.append(list(deltas))
+            if len(self.steps) > UndoStack.MaxSteps:
+                del self.steps[0]
+
+        self.index = len(self.steps)
+        self.mergeKey = mergeKey
+        self.mergeTime = now
+
+    @staticmethod
+    def merge(step, deltas):
+        sets = dict(((d[1], d[2]), i) for i, d in enumerate(step) if d[0] == "set")
+
+        for delta in deltas:
+            i = sets.get((delta[1], delta[2])) if delta[0] == "set" else None
+            if i is None:
+                step.append(delta)
+            else:
+                op, key, attr, old, _ = step[i]
+                step[i] = (op, key, attr, old, delta[4])
+
+    def canUndo(self):
+        return self.index > 0
+
+    def canRedo(self):
+        return self.index < len(self.steps)
+
+    def undo(self):
+        ''' deltas of the undone step in reverse order, to be applied backwards '''
+        if not self.canUndo():
+            return []
+
+        self.index -= 1
+        self.mergeKey = None
+        return list(reversed(self.steps[self.index]))
+
+    def redo(self):
+        if not self.canRedo():
+            return []
+
+        self.index += 1
+        self.mergeKey = None
+        return list(self.steps[self.index-1])
+
+class SelectionTransform(object):
+    '''
+    Positions and bounds (x, y, width, height) of a selection kept as flat arrays.
+    Operations compute the new positions of all items at once, the union bounds are computed once.
+    '''
+    def __init__(self, positions, bounds):
+        self.xs = array("d", [p[0] for p in positions])
+        self.ys = array("d", [p[1] for p in positions])
+
+        self.lefts = array("d", [b[0] for b in bounds])
+        self.tops = array("d", [b[1] for b in bounds])
+        self.rights = array("d", [b[0]+b[2] for b in bounds])
+        self.bottoms = array("d", [b[1]+b[3] for b in bounds])
+
+        self.left = min(self.lefts) if bounds else 0.0
+        self.top = min(self.tops) if bounds else 0.0
+        self.right = max(self.rights) if bounds else 0.0
+        self.bottom = max(self.bottoms) if bounds else 0.0
+
+    def clampDelta(self, dx, dy, limits):
+        ''' delta that keeps the union bounds within limits (left, top, right, bottom) '''
+        dx = clamp(limits[0]-self.left, limits[2]-self.right, dx)
+        dy = clamp(limits[1]-self.top, limits[3]-self.bottom, dy)
+        return dx, dy
+
+    def translated(self, dx, dy):
+        return zip([x+dx for x in self.xs], [y+dy for y in self.ys])
+
+    def movedBounds(self, lefts, tops):
+        ''' positions for new bounds corners '''
+        return zip([x + l - l0 for x, l, l0 in zip(self.xs, lefts, self.lefts)],
+                   [y + t - t0 for y, t, t0 in zip(self.ys, tops, self.tops)])
+
+    def aligned(self, edge):
+        ''' edge is one of left, right, hcenter, top, bottom, vcenter '''
+        lefts, tops = self.lefts, self.tops
+
+        if edge == "left":
+            lefts = [self.left] * len(lefts)
+        elif edge == "right":
+            lefts = [self.right - (r - l) for l, r in zip(self.lefts, self.rights)]
+        elif edge == "hcenter":
+            center = (self.left + self.right) / 2.0
+            lefts = [center - (r - l) / 2.0 for l, r in zip(self.lefts, self.rights)]
+        elif edge == "top":
+            tops = [self.top] * len(tops)
+        elif edge == "bottom":
+            tops = [self.bottom - (b - t) for t, b in zip(self.tops, self.bottoms)]
+        elif edge == "vcenter":
+            center = (self.top + self.bottom) / 2.0
+            tops = [center - (b - t) / 2.0 for t, b in zip(self.tops, self.bottoms)]
+
+        return self.movedBounds(lefts, tops)
+
+    def distributed(self, horizontal=True):
+        ''' equal gaps between the bounds over the union bounds, items are kept within the union bounds '''
+        n = len(self.xs)
+        lefts, tops = list(self.lefts), list(self.tops)
+        if n < 3:
+            return self.movedBounds(lefts, tops)
+
+        starts, ends = (self.lefts, self.rights) if horizontal else (self.tops, self.bottoms)
+        unionStart, unionEnd = (self.left, self.right) if horizontal else (self.top, self.bottom)
+        order = sorted(range(n), key=lambda i: starts[i])
+
+        extent = sum([ends[i] - starts[i] for i in order])
+        gap = (unionEnd - unionStart - extent) / float(n - 1) # negative when the items can't fit without overlapping
+
+        values = lefts if horizontal else tops
+        current = unionStart
+        for i in order:
+            size = ends[i] - starts[i]
+            values[i] = clamp(unionStart, max(unionStart, unionEnd - size), current)
+            current += size + gap
+
+        return self.movedBounds(lefts, tops)
+
+    def mirrored(self, horizontal=True):
+        ''' positions mirrored about the center of the union bounds '''
+        lefts, tops = self.lefts, self.tops
+        if horizontal:
+            lefts = [self.left + self.right - r for r in self.rights]
+        else:
+            tops = [self.top + self.bottom - b for b in self.bottoms]
+
+        return self.movedBounds(lefts, tops)
+
+    @staticmethod
+    def scaledSizes(sizes, factor):
+        return [(int(round(w * factor)), int(round(h * factor))) for w, h in sizes]
+
+def clamp(mn, mx, val):
+    if mn!=None and val < mn:
+        return mn
+    elif mx!=None and val > mx:
+        return mx
+    else:
+        return val
+    
+
+class CommandCache(object):
+    '''
+    LRU of compiled widget commands keyed by the command text.
+    $NAMESPACE is compiled as a variable, so one code object serves every namespace.
+    Only $NAMESPACE in code is rewritten, strings and comments are left as typed.
+    '''
+    NamespaceVariable = "__vptools_namespace__"
+    MaxSize = 256
+
+    def __init__(self):
+        self.codes = OrderedDict()
+
+    def compile(self, command):
+        code = self.codes.pop(command, None)
+        if code is None:
+            code = compile(CommandCache.substituteNamespace(command), "<vptools command>", "exec")
+
+        self.codes[command] = code
+        while len(self.codes) > CommandCache.MaxSize:
+            self.codes.popitem(last=False)
+
+        return code
+
+    @staticmethod
+    def substituteNamespace(command):
+        lines = command.splitlines(True)
+
+        found = [] # (row, col) of $ in $NAMESPACE tokens
+        previous = None
+        try:
+            for token in tokenize.generate_tokens(iter(lines).next):
+                if token[0] == tokenize.NAME and token[1] == "NAMESPACE" and previous and previous[1] == "$" and previous[3] == token[2]:
+                    found.append(previous[2])
+                previous = token
+
+        except (tokenize.TokenError, IndentationError):
+            pass # compile reports the error
+
+        for row, col in reversed(found):
+            line = lines[row-1]
+            lines[row-1] = line[:col] + CommandCache.NamespaceVariable + line[col+len("$NAMESPACE"):]
+
+        return "".join(lines)
+
+    def discard(self, command):
+        self.codes.pop(command, None)
+
+    def execute(self, command, namespace):
+        exec self.compile(command) in {CommandCache.NamespaceVariable: namespace}
+
+class VisibilityResolver(object):
+    '''
+    Same result as isActualVisible, but existence is checked with one ls per namespace
+    and every DAG node's visibility is queried once per pass and shared by its descendants.
+    '''
+    VisibilityAttributes = ["v", "visibility"]
+    MaxConnectionDepth = 8
+
+    def __init__(self, maya):
+        self.maya = maya
+        self.namespace = ""
+        self.longNames = {}
+        self.visibility = {}
+        self.shapes = {}
+        self.shapeVisibility = {}
+
+    def reset(self, namespace):
+        self.namespace = namespace
+        self.longNames = {}
+        self.invalidate()
+
+        for node in self.maya.namespaceNodes(namespace):
+            shortName = node.split("|")[-1]
+            if shortName not in self.longNames:
+                self.longNames[shortName] = node
+
+    def invalidate(self):
+        self.visibility = {}
+        self.shapes = {}
+        self.shapeVisibility = {}
+
+    def longName(self, ctrl):
+        return self.longNames.get(self.namespace+":"+ctrl if self.namespace else ctrl)
+
+    def isEnabled(self, ctrl):
+        node = self.longName(ctrl)
+        if not node:
+            return False
+
+        return self.hasVisibleShapes(node) and self.isVisible(node)
+
+    def getShapes(self, node):
+        if node not in self.shapes:
+            self.shapes[node] = self.maya.shapes(node)
+        return self.shapes[node]
+
+    def hasVisibleShapes(self, node):
+        if node not in self.shapeVisibility:
+            shapes = self.getShapes(node)
+            self.shapeVisibility[node] = not shapes or any(self.maya.getVisibility(sh) for sh in shapes)
+        return self.shapeVisibility[node]
+
+    def dependencies(self, ctrl):
+        ''' the control node, its shapes and its ancestors '''
+        node = self.longName(ctrl)
+        if not node:
+            return []
+
+        nodes = list(self.getShapes(node))
+        while node:
+            nodes.append(node)
+            node = node.rpartition("|")[0]
+        return nodes
+
+    def affectedNodes(self, attr):
+        '''
+        Long names of the DAG nodes whose visibility can depend on attr.
+        Non visibility attributes (like ikfk) are followed downstream through the DG.
+        '''
+        node, _, attrName = attr.partition(".")
+        if attrName in VisibilityResolver.VisibilityAttributes:
+            return self.maya.longNames(node)
+
+        found = set()
+        plugs = [attr]
+        for _ in range(VisibilityResolver.MaxConnectionDepth):
+            nodes = set()
+            for plug in plugs:
+                nodes.update(self.maya.destinations(plug))
+
+            nodes -= found
+            if not nodes:
+                break
+
+            found.update(nodes)
+            plugs = list(nodes)
+
+        return self.maya.longNames(list(found), dagOnly=True) if found else []
+
+    def isVisible(self, node):
+        ''' node and all its ancestors are visible, node is a long name '''
+        path = []
+        while node and node not in self.visibility:
+            path.append(node)
+            node = node.rpartition("|")[0]
+
+        visible = self.visibility[node] if node else True
+        for node in reversed(path):
+            visible = visible and self.maya.getVisibility(node)
+            self.visibility[node] = visible
+
+        return visible
+
+class AttributeWatcherRegistry(object):
+    '''
+    Keeps one attribute changed callback per watched node.
+    watch() only adds and removes the difference between the old and the new set of nodes.
+    Visibility is matched by both its short and long name.
+    '''
+    def __init__(self, maya, attributes, callback):
+        self.maya = maya
+        self.attributes = set(attributes)
+        if self.attributes & set(VisibilityResolver.VisibilityAttributes):
+            self.attributes.update(VisibilityResolver.VisibilityAttributes)
+        self.callback = callback
+        self.callbackIds = {}
+
+    def watch(self, nodes):
+        nodes = set(nodes)
+        current = set(self.callbackIds)
+
+        for node in current - nodes:
+            self.removeWatcher(node)
+
+        for node in nodes - current:
+            self.addWatcher(node)
+
+    def addWatcher(self, node):
+        callbackId = self.maya.addAttributeChangedCallback(node, self.attributeChangedCallback)
+        if callbackId is not None:
+            self.callbackIds[node] = callbackId
+
+    def removeWatcher(self, node):
+        callbackId = self.callbackIds.pop(node, None)
+        if callbackId is not None:
+            self.maya.removeCallback(callbackId)
+
+    def clear(self):
+        for node in list(self.callbackIds):
+            self.removeWatcher(node)
+
+    def attributeChangedCallback(self, plug):
+        if plug.rpartition(".")[2] in self.attributes:
+            self.callback(plug)
+
+class DependencyIndex(object):
+    ''' Maps Maya nodes (long names) to the VPcontrol items whose enabled state depends on them '''
+    def __init__(self):
+        self.itemsByNode = {}
+        self.nodesByItem = {}
+
+    def clear(self):
+        self.itemsByNode = {}
+        self.nodesByItem = {}
+
+    def add(self, item, nodes):
+        self.remove(item)
+        self.nodesByItem[item] = nodes
+        for node in nodes:
+            self.itemsByNode.setdefault(node, set()).add(item)
+
+    def remove(self, item):
+        for node in self.nodesByItem.pop(item, []):
+            items = self.itemsByNode.get(node)
+            if items:
+                items.discard(item)
+
+    def itemsFor(self, nodes):
+        items = set()
+        for node in nodes:
+            items.update(self.itemsByNode.get(node, ()))
+        return items
+
+class TimingStat(object):
+    ''' Call count, last/total/max time and a histogram of call times '''
+    Buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0] # seconds
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(TimingStat.Buckets) + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.last = elapsed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.histogram[bisect.bisect_left(TimingStat.Buckets, elapsed)] += 1
+
+    def toDict(self, duration):
+        return {"count": self.count,
+                "last": self.last,
+                "avg": self.total / self.count if self.count else 0.0,
+                "max": self.max,
+                "total": self.total,
+                "perSecond": self.count / duration if duration > 0 else 0.0,
+                "histogram": dict(zip(["<%g"%b for b in TimingStat.Buckets] + [">=%g"%TimingStat.Buckets[-1]], self.histogram))}
+
+class Instrumentation(object):
+    '''
+    Timings of registered functions and methods.
+    Targets are wrapped only while enabled, so disabled instrumentation costs nothing.
+    '''
+    def __init__(self):
+        self.targets = []
+        self.originals = {}
+        self.stats = {}
+        self.isEnabled = False
+        self.startTime = time.time()
+
+    def register(self, owner, attrName, name=None):
+        ''' owner is a class or a module '''
+        name = name or "%s.%s"%(owner.__name__, attrName)
+        self.targets.append((owner, attrName, name))
+
+        if self.isEnabled:
+            self.wrap(owner, attrName, name)
+
+    def wrap(self, owner, attrName, name):
+        original = owner.__dict__[attrName]
+        isStatic = isinstance(original, staticmethod)
+        func = original.__func__ if isStatic else original
+
+        def timed(*args, **kwargs):
+            startTime = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.time() - startTime)
+
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+
+        self.originals[(owner, attrName)] = original
+        setattr(owner, attrName, staticmethod(timed) if isStatic else timed)
+
+    def enable(self):
+        if self.isEnabled:
+            return
+
+        self.isEnabled = True
+        for owner, attrName, name in self.targets:
+            self.wrap(owner, attrName, name)
+
+    def disable(self):
+        if not self.isEnabled:
+            return
+
+        self.isEnabled = False
+        for (owner, attrName), original in self.originals.items():
+            setattr(owner, attrName, original)
+        self.originals = {}
+
+    def record(self, name, elapsed):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = TimingStat()
+        stat.add(elapsed)
+
+    def reset(self):
+        self.stats = {}
+        self.startTime = time.time()
+
+    def summary(self):
+        duration = time.time() - self.startTime
+        return dict((name, stat.toDict(duration)) for name, stat in self.stats.items())
+
+    def dump(self, path, **info):
+        data = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "duration": time.time() - self.startTime,
+                "stats": self.summary()}
+        data.update(info)
+
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+class PresetIndex(object):
+    '''
+    Persistent index of control presets (name, type, size, colors, tags, mtime) over several directories.
+    Only new or modified files are parsed when a directory is scanned.
+    Tags come from the preset's "tags" attribute plus the label of its root directory, "#tag" searches them.
+    '''
+    Version = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.ordered = None # paths sorted by name
+        self.lastQuery = None
+        self.lastResult = None
+
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if data.get("version") == PresetIndex.Version:
+            self.entries = data.get("entries", {})
+            for entry in self.entries.values():
+                PresetIndex.updateSearchKey(entry)
+            self.invalidate()
+
+    def save(self):
+        if not self.path:
+            return
+
+        entries = dict((path, dict((k, v) for k, v in entry.items() if k != "search")) for path, entry in self.entries.items())
+        tmpPath = self.path + ".tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            with open(tmpPath, "w") as f:
+                json.dump({"version": PresetIndex.Version, "entries": entries}, f)
+
+            replaceFile(tmpPath, self.path)
+
+        except (IOError, OSError):
+            pass
+
+    @staticmethod
+    def updateSearchKey(entry):
+        entry["search"] = " ".join([entry["name"], entry["label"], entry["control"]]).lower()
+
+    @staticmethod
+    def parseEntry(path, mtime, rootLabel=""):
+        element = ET.parse(path).getroot()
+        return PresetIndex.makeEntry(path, mtime, element, VPControlProps.fromXmlElement(element), rootLabel)
+
+    @staticmethod
+    def makeEntry(path, mtime, element, props, rootLabel=""):
+        ''' entry of a parsed preset, element is the root of the preset file '''
+        tags = [t.strip().lower() for t in element.get("tags", "").split(",") if t.strip()]
+        if rootLabel:
+            tags.append(rootLabel.lower())
+
+        entry = {"name": os.path.splitext(os.path.basename(path))[0],
+                 "directory": os.path.dirname(path),
+                 "mtime": mtime,
+                 "type": props.type,
+                 "size": list(props.size),
+                 "color": list(props.color),
+                 "textColor": list(props.textColor),
+                 "label": props.label,
+                 "control": props.control,
+                 "tags": tags}
+
+        PresetIndex.updateSearchKey(entry)
+        return entry
+
+    def staleFiles(self, directory):
+        '''
+        Only stats the presets of the directory: forgets the removed ones and returns ([(path, mtime)], removed)
+        where the list holds new or modified presets. The caller parses them and sets the entries.
+        '''
+        directory = os.path.normpath(directory)
+
+        stale = []
+        found = set()
+        for path in glob.glob(directory+"/*.xml"):
+            path = os.path.normpath(path)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+
+            found.add(path)
+            entry = self.entries.get(path)
+            if not entry or entry["mtime"] != mtime:
+                stale.append((path, mtime))
+
+        removed = [p for p, e in self.entries.items() if e["directory"] == directory and p not in found]
+        for path in removed:
+            del self.entries[path]
+
+        if removed:
+            self.invalidate()
+        return stale, bool(removed)
+
+    def setEntry(self, path, entry):
+        self.entries[path] = entry
+        self.invalidate()
+
+    def removeEntry(self, path):
+        if self.entries.pop(path, None):
+            self.invalidate()
+
+    def scanDirectory(self, directory, rootLabel=""):
+        ''' parses new or modified presets in place, returns True if the index changed '''
+        stale, changed = self.staleFiles(directory)
+
+        for path, mtime in stale:
+            try:
+                self.entries[path] = PresetIndex.parseEntry(path, mtime, rootLabel)
+            except (IOError, OSError, ET.ParseError):
+                self.entries.pop(path, None)
+            changed = True
+
+        if stale:
+            self.invalidate()
+        return changed
+
+    def invalidate(self):
+        self.ordered = None
+        self.lastQuery = None
+
+    def removeDirectory(self, directory):
+        directory = os.path.normpath(directory)
+        for path in [p for p, e in self.entries.items() if e["directory"] == directory]:
+            del self.entries[path]
+        self.invalidate()
+
+    def search(self, text=""):
+        '''
+        Presets matching every word (substring of name, label or control) and every #tag (tag prefix),
+        sorted by name. A query that extends the previous one only filters the previous result.
+        '''
+        text = text.lower()
+        if self.lastQuery is not None and text.startswith(self.lastQuery):
+            candidates = self.lastResult
+        else:
+            if self.ordered is None:
+                self.ordered = sorted(self.entries, key=lambda p: (self.entries[p]["name"], p))
+            candidates = self.ordered
+
+        words = []
+        tags = []
+        for token in text.split():
+            if token.startswith("#"):
+                tags.append(token[1:])
+            else:
+                words.append(token)
+
+        if not words and not tags:
+            result = list(candidates)
+        else:
+            result = []
+            for path in candidates:
+                entry = self.entries[path]
+                if all(w in entry["search"] for w in words) and all(any(t.startswith(tag) for t in entry["tags"]) for tag in tags):
+                    result.append(path)
+
+        self.lastQuery = text
+        self.lastResult = result
+        return result
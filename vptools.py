@@ -10,266 +10,145 @@ except:
 import math
 import time
 import os
+import sys
 import re
-import xml.etree.ElementTree as ET
-import glob
 import string
 import json
+import traceback
+from collections import OrderedDict, deque
 from xml.sax.saxutils import escape, unescape
 
-import pymel.core as core
-import pymel.api as api
-import maya.cmds as cmds
-
 from maya import OpenMayaUI as apiUI
 from shiboken2 import wrapInstance
 
-MayaProjectDirectory = os.path.dirname(cmds.workspace(q=True, rd=True))
 VPToolsDirectory = "D:/My/3D/Scripts/vptools"
-VPToolsLocalDirectory = MayaProjectDirectory+"/vptools"
-
-def color2hex(color):
-    return "#%.2x%.2x%.2x"%color
-
-def point2str(p):
-    return "%d %d"%p
-
-def points2str(points):
-    return ",".join([point2str(p) for p in points])
-
-def text2points(text):
-    if not text:
-        return []
-    
-    points = []
-    for pd in text.split(","):
-        x,y = pd.split()
-        x = int(x.strip())
-        y = int(y.strip())
-        points.append((x,y))
-
-    return points
-
-class VPControlProps(object):
-    PolygonType = 0
-    EllipseType = 1
-    RectType = 2
-
-    Margin = 2
-
-    MinPositionX = 0
-    MinPositionY = 0
-
-    def __init__(self,
-                 type=RectType,
-                 position=(0, 0),
-                 rotation=0,
-                 invert=False,
-                 size=(10, 10),
-                 textColor=(0, 0, 0),
-                 color=(0, 0, 0),
-                 roundRadius=25,
-                 gradient=True,
-                 label="",
-                 points=[],
-                 control="",
-                 command="print \"hello world\""):
-
-        self.type = type
-
-        self.position = position
-        self.rotation = rotation
-        self.invert = invert
-        self.size = size
-
-        self.textColor = textColor
-        self.color = color
-        self.gradient = gradient
-        self.roundRadius = roundRadius
-
-        self.label = label
-
-        self.points = list(points)
-
-        self.control = control
-        self.command = command
-
-    def copy(self):
-        s = VPControlProps()
-        s.type = self.type
 
-        s.position = tuple(self.position)
-        s.rotation = self.rotation
-        s.invert = self.invert
-        s.size = tuple(self.size)
+if VPToolsDirectory not in sys.path:
+    sys.path.append(VPToolsDirectory)
 
-        s.textColor = self.textColor
-        s.color = self.color
-        s.gradient = self.gradient
-        s.roundRadius = self.roundRadius
+from vpcore import *
 
-        s.label = self.label
+mayaAccess = MayaAccess()
 
-        s.points = list(self.points)
-
-        s.control = self.control
-        s.command = self.command
-        return s        
-    
-    def getScaledPoints(self):
-        maxX, maxY = 0.001, 0.001
-        for x,y in self.points:
-            if x > maxX:
-                maxX = x
-            if y > maxY:
-                maxY = y
-
-        scaledPoints = []
-        for x,y in self.points:
-            scaledX = x / float(maxX) * self.size[0]
-            scaledY = y / float(maxY) * self.size[1]
-
-            scaledX += VPControlProps.Margin
-            scaledY += VPControlProps.Margin
-
-            scaledPoints.append((scaledX, scaledY))
-
-        return scaledPoints
-
-    def boundingRect(self):
-        if self.type == VPControlProps.PolygonType:
-            w = 0
-            h = 0
-            for p in self.getScaledPoints():
-                if p[0] > w:
-                    w = p[0]
-
-                if p[1] > h:
-                    h = p[1]
-
-            return (0,0,w+VPControlProps.Margin,h+VPControlProps.Margin)
-
-        else:
-            return (0,0,self.size[0] + VPControlProps.Margin, self.size[1] + VPControlProps.Margin)
-
-    def toXml(self):
-        return "\n".join(["".join(["<control ",
-                                   " ".join(["type=\"{type}\"",
-                                             "position=\"{x},{y}\"",
-                                             "rotation=\"{rotation}\"",
-                                             "invert=\"{invert}\"",
-                                             "size=\"{w},{h}\"",
-                                             "label=\"{label}\"",
-                                             "color=\"{color}\"",
-                                             "gradient=\"{gradient}\"",
-                                             "textColor=\"{textColor}\"",
-                                             "roundRadius=\"{roundRadius}\"",
-                                             "points=\"{points}\"",
-                                             "control=\"{control}\""]).format(
-                                                 type=self.type,
-                                                 x=int(self.position[0]),
-                                                 y=int(self.position[1]),
-                                                 rotation=int(self.rotation),
-                                                 invert=int(self.invert),
-                                                 w=int(self.size[0]),
-                                                 h=int(self.size[1]),
-                                                 label=self.label,
-                                                 roundRadius=int(self.roundRadius),
-                                                 color="%d,%d,%d"%self.color,
-                                                 gradient=int(self.gradient),
-                                                 textColor="%d,%d,%d"%self.textColor,
-                                                 points=points2str(self.points),
-                                                 control=self.control),
-                                   ">"]),
-                          "\n".join(["<command>",
-                                     "<![CDATA[%s]]>"%self.command.strip(),
-                                     "</command>"]),
-                          "</control>"])
-
-    def saveToFile(self, path):
-        with open(path, "w") as f:
-            f.write(self.toXml())
-
-    @staticmethod
-    def saveToFileList(path, props):
-        xmls = []
-        for p in props:
-            xmls.append(p.toXml())
-
-        with open(path, "w") as f:
-            f.write("\n".join(["<props>",
-                               "\n".join(xmls),
-                               "</props>"]))
-
-
-    @staticmethod
-    def fromXmlElement(element):
-        s = VPControlProps()
-        s.type = int(element.get("type",0))
-        s.position = tuple([int(v) for v in element.get("position", (0,0)).split(",")])
-        s.rotation = int(element.get("rotation", 0))
-        s.invert = bool(int(element.get("invert", False)))
-        s.size = tuple([int(v) for v in element.get("size", (0,0)).split(",")])
-        s.label = element.get("label", "")
-        s.color = tuple([int(v) for v in element.get("color").split(",")])
-        s.textColor = tuple([int(v) for v in element.get("textColor").split(",")])
-        s.gradient = bool(int(element.get("gradient")))
-        s.roundRadius = int(element.get("roundRadius", 0))
-        if element.get("points"):
-            s.points = [(int(x), int(y)) for x,y in [p.split() for p in element.get("points").split(",")]]
-
-        s.control = element.get("control","")
-        s.command = element.findtext("command","").strip()
-
-        if s.position[0] < VPControlProps.MinPositionX:
-            VPControlProps.MinPositionX = s.position[0]
-        if s.position[1] < VPControlProps.MinPositionY:
-            VPControlProps.MinPositionY = s.position[1]            
-        return s
+MayaProjectDirectory = os.path.dirname(mayaAccess.workspaceDirectory())
+VPToolsLocalDirectory = MayaProjectDirectory+"/vptools"
+VPToolsCacheDirectory = VPToolsLocalDirectory+"/cache"
+
+CharacterMarkerControl = "M_spine_fk_1_control" # a reference is a character if it has this node
+
+class VPControlRenderCache(object):
+    '''
+    Prerendered control pixmaps shared by all items with the same visual props, state and device pixel ratio.
+    Least recently used pixmaps are dropped when MaxSize is exceeded.
+    '''
+    NormalState = 0
+    HoverState = 1
+    DisabledState = 2
+
+    MaxSize = 2000
+
+    def __init__(self):
+        self.pixmaps = OrderedDict()
+
+    def get(self, key):
+        pixmap = self.pixmaps.pop(key, None)
+        if pixmap is not None:
+            self.pixmaps[key] = pixmap
+        return pixmap
+
+    def render(self, key, props, rect, widget=None):
+        _, state, selected, ratio = key
+
+        pixmap = QPixmap(int(math.ceil((rect.width()+1) * ratio)), int(math.ceil((rect.height()+1) * ratio)))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
+        if widget:
+            painter.setFont(widget.font())
+        VPcontrol.drawControl(painter, props, state, selected)
+        painter.end()
+
+        self.pixmaps[key] = pixmap
+        while len(self.pixmaps) > VPControlRenderCache.MaxSize:
+            self.pixmaps.popitem(last=False)
+
+        return pixmap
+
+    def clear(self):
+        self.pixmaps.clear()
+
+class CommandQueue(object):
+    '''
+    Widget clicks are queued and run from Maya's idle queue, so the overlay never blocks.
+    Repeated clicks on the same widget are merged, the merged click runs at its latest position.
+    Every batch is one undo chunk.
+    '''
+    SlowCommandTime = 0.5 # seconds
+    MaxTimings = 100
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.isScheduled = False
+        self.mergedCount = 0
+        self.timings = deque(maxlen=CommandQueue.MaxTimings)
+
+    def depth(self):
+        return len(self.pending)
+
+    def push(self, key, label, func):
+        if self.pending.pop(key, None):
+            self.mergedCount += 1
+
+        self.pending[key] = (label, func)
+
+        if not self.isScheduled:
+            self.isScheduled = True
+            mayaAccess.evalDeferred(lambda: self.flush())
+
+    def flush(self):
+        self.isScheduled = False
+        batch = self.pending
+        self.pending = OrderedDict()
+
+        mayaAccess.openUndoChunk("vptools")
+        try:
+            for label, func in batch.values():
+                startTime = time.time()
+                try:
+                    func()
+                except Exception:
+                    traceback.print_exc()
 
-    @staticmethod
-    def fromXml(text):
-        root = ET.fromstring(text).getroot()
-        return VPControlProps.fromXmlElement(root)
+                elapsed = time.time() - startTime
+                self.timings.append((label, elapsed))
 
-    @staticmethod
-    def loadFromFileList(path):
-        root = ET.parse(path).getroot()
-        props = []
-        for e in root.iter("control"):
-            props.append(VPControlProps.fromXmlElement(e))
-        return props
+                if elapsed > CommandQueue.SlowCommandTime:
+                    mayaAccess.warning("vptools: '%s' took %.2f sec"%(label, elapsed))
+        finally:
+            mayaAccess.closeUndoChunk()
 
-    @staticmethod
-    def loadFromFile(path):
-        root = ET.parse(path).getroot()
-        return VPControlProps.fromXmlElement(root)
+layoutCache = LayoutCache(VPToolsCacheDirectory)
+commandCache = CommandCache()
+commandQueue = CommandQueue()
 
-    @staticmethod
-    def listControls():
-        files = []
-        for f in glob.glob(VPToolsDirectory+"/controls/*.xml"):
-            files.append(f)
-        return files
-
-def clamp(mn, mx, val):
-    if mn!=None and val < mn:
-        return mn
-    elif mx!=None and val > mx:
-        return mx
-    else:
-        return val
-    
 class VPcontrol(QGraphicsItem):
+    renderCache = VPControlRenderCache()
+    NonVisualProps = set(["control", "command"]) # changing them doesn't repaint
+
     def __init__(self, vpcontrolProps, editable=True, **kwargs):
         super(VPcontrol, self).__init__(**kwargs)
 
         self.vpcontrolProps = vpcontrolProps
+        self.controlId = None # position in the layout, see EditJournal
         self.isDragging = False
         self.isHover = False
         self.isEditable = editable
-        self.dragDelta = QPoint()
-        self.defaultColor = None
+        self.propsRenderKey = None
+
+        self.geometryVersion = None
+        self.boundingRectCache = None
+        self.shapeCache = None
 
         self.setFlags(QGraphicsItem.ItemIsSelectable)
         self.setAcceptHoverEvents(True)
@@ -283,24 +162,111 @@ class VPcontrol(QGraphicsItem):
         self.setTransform(QTransform.fromScale(-1 if self.vpcontrolProps.invert else 1, 1))
         self.setPos(x, y)
 
+    def updateGeometryCache(self):
+        props = self.vpcontrolProps
+        if self.geometryVersion == props.geometryVersion:
+            return
+
+        r = props.boundingRect()
+        self.boundingRectCache = QRectF(r[0], r[1], r[2], r[3])
+
+        margin = VPControlProps.Margin
+        path = QPainterPath()
+        if props.type == VPControlProps.PolygonType:
+            poly = QPolygonF()
+            for x, y in props.getScaledPoints():
+                poly.append(QPointF(x, y))
+            path.addPolygon(poly)
+            path.closeSubpath()
+
+        elif props.type == VPControlProps.EllipseType:
+            path.addEllipse(margin, margin, props.size[0]-margin, props.size[1]-margin)
+
+        else:
+            path.addRect(self.boundingRectCache)
+
+        self.shapeCache = path
+        self.geometryVersion = props.geometryVersion
+
     def boundingRect(self):
-        sc = self.vpcontrolProps
-        r = sc.boundingRect()
-        return QRectF(r[0], r[1], r[2], r[3])
+        self.updateGeometryCache()
+        return self.boundingRectCache
+
+    def shape(self):
+        self.updateGeometryCache()
+        return self.shapeCache
+
+    def setProp(self, name, value):
+        if name in VPControlProps.GeometryAttributes:
+            self.prepareGeometryChange()
+
+        self.vpcontrolProps.__setattr__(name, value)
+
+    def applyProp(self, name, value):
+        ''' sets a property and updates the item, only the item is repainted '''
+        self.setProp(name, value)
+
+        if name == "rotation":
+            self.setRotation(value)
+
+        elif name == "invert":
+            oldPos = self.pos()
+            self.setPos(0,0)
+            self.setTransform(QTransform.fromScale(-1 if value else 1, 1))
+            self.setPos(oldPos)
+
+        elif name == "control":
+            self.setToolTip(value)
+
+        if name not in VPcontrol.NonVisualProps:
+            self.invalidateRenderCache()
+
+    def renderKey(self, ratio=1.0):
+        if self.propsRenderKey is None:
+            props = self.vpcontrolProps
+            self.propsRenderKey = (props.type,
+                                   tuple(props.size),
+                                   tuple(props.points),
+                                   tuple(props.color),
+                                   tuple(props.textColor),
+                                   props.gradient,
+                                   props.roundRadius,
+                                   props.label)
+
+        if not self.isEnabled():
+            state = VPControlRenderCache.DisabledState
+        elif self.isHover:
+            state = VPControlRenderCache.HoverState
+        else:
+            state = VPControlRenderCache.NormalState
+
+        return (self.propsRenderKey, state, self.isSelected(), ratio)
+
+    def invalidateRenderCache(self):
+        self.propsRenderKey = None
+        self.update()
 
     def paint(self, painter, option, widget=None):
-        props = self.vpcontrolProps
+        key = self.renderKey(widget.devicePixelRatioF() if widget else 1.0)
+        pixmap = VPcontrol.renderCache.get(key)
+        if pixmap is None:
+            pixmap = VPcontrol.renderCache.render(key, self.vpcontrolProps, self.boundingRect(), widget)
+
+        painter.drawPixmap(0, 0, pixmap)
 
+    @staticmethod
+    def drawControl(painter, props, state, selected):
         painter.setRenderHints(QPainter.Antialiasing)
-        self.defaultColor = QColor(props.color[0], props.color[1], props.color[2])
+        defaultColor = QColor(props.color[0], props.color[1], props.color[2])
 
-        color = self.defaultColor.lighter(133) if self.isHover else self.defaultColor
-        color = color if self.isEnabled() else QColor(88,88, 88)
+        isEnabled = state != VPControlRenderCache.DisabledState
+        color = defaultColor.lighter(133) if state == VPControlRenderCache.HoverState else defaultColor
+        color = color if isEnabled else QColor(88,88, 88)
         color.setAlpha(166)
         painter.setPen(QColor(33,33,33))
-        if props.gradient and self.isEnabled():
-            rect = self.boundingRect()
-            gradient = QLinearGradient(0, rect.height() / 2, 0, 0)
+        if props.gradient and isEnabled:
+            r = props.boundingRect()
+            gradient = QLinearGradient(0, r[3] / 2.0, 0, 0)
             gradient.setColorAt(0, color)
             gradient.setColorAt(1, QColor.fromRgbF(1, 1, 1, 1))
             painter.setBrush(gradient)
@@ -333,7 +299,7 @@ class VPcontrol(QGraphicsItem):
             painter.drawText(center - textOffset, props.label)
 
         r = props.boundingRect()
-        if self.isSelected():
+        if selected:
             painter.setBrush(Qt.NoBrush)
             pen = painter.pen()
             pen.setColor(Qt.white) # white
@@ -384,11 +350,33 @@ class VPcontrol(QGraphicsItem):
         removeAction = menu.addAction("Remove")
         removeAction.triggered.connect(self.removeItems)
 
+        scene = self.scene()
+        if len(scene.selectedItems()) > 1:
+            arrangeMenu = menu.addMenu("Arrange")
+
+            for label, op, arg in [("Align Left", "aligned", "left"),
+                                   ("Align Horizontal Center", "aligned", "hcenter"),
+                                   ("Align Right", "aligned", "right"),
+                                   ("Align Top", "aligned", "top"),
+                                   ("Align Vertical Center", "aligned", "vcenter"),
+                                   ("Align Bottom", "aligned", "bottom"),
+                                   None,
+                                   ("Distribute Horizontally", "distributed", True),
+                                   ("Distribute Vertically", "distributed", False),
+                                   None,
+                                   ("Mirror Horizontally", "mirrored", True),
+                                   ("Mirror Vertically", "mirrored", False)]:
+                if label is None:
+                    arrangeMenu.addSeparator()
+                    continue
+
+                action = arrangeMenu.addAction(label)
+                action.triggered.connect(lambda checked=False, op=op, arg=arg: scene.arrangeSelection(op, arg))
+
         menu.exec_(event.screenPos())
 
     def removeItems(self):
-        for item in self.scene().selectedItems():
-            self.scene().removeItem(item)
+        self.scene().removeControls(self.scene().selectedItems())
 
     def copyItems(self):
         selected = self.scene().selectedItems()
@@ -401,7 +389,9 @@ class VPcontrol(QGraphicsItem):
             it = self.scene().insertControl(item.vpcontrolProps.copy())
             if isMulti:
                 it.setPos(item.pos() + Offset)
-                newItems.append(it)
+            newItems.append(it)
+
+        self.scene().recordAdded(newItems)
 
         if isMulti:
             self.scene().clearSelection()
@@ -412,7 +402,7 @@ class VPcontrol(QGraphicsItem):
     def saveToFile(self):
         text, ok = QInputDialog.getText(self.scene().mainWindow, "VPTools", "Name")
         if ok:
-            self.vpcontrolProps.saveToFile("./controls/%s.xml"%(text))
+            controlLibrary.savePreset(self.vpcontrolProps, text)
 
     def mouseMoveEvent(self, event):
         shift = event.modifiers() & Qt.ShiftModifier
@@ -422,18 +412,7 @@ class VPcontrol(QGraphicsItem):
         if not self.isDragging or not self.isEditable:
             return
 
-        for item in self.scene().selectedItems():
-            if item.isDragging:
-                tr = item.transform()
-                newPos = event.scenePos() - item.dragDelta
-
-                if shift:
-                    newPos.setX(int(newPos.x()) / 5 * 5)
-                    newPos.setY(int(newPos.y()) / 5 * 5)
-
-                newPos.setX(clamp(0, self.scene().mainWindow.width()-self.boundingRect().width()-25, newPos.x()))
-                newPos.setY(clamp(0, self.scene().mainWindow.height()-self.boundingRect().height()-25, newPos.y()))
-                item.setPos(newPos)
+        self.scene().moveSelection(event.scenePos(), snap=shift)
 
     def mousePressEvent(self, event):
         shift = event.modifiers() & Qt.ShiftModifier
@@ -446,9 +425,8 @@ class VPcontrol(QGraphicsItem):
             if event.buttons() == Qt.LeftButton:
 
                 if self.isSelected(): # move
-                    for item in scene.selectedItems():
-                        item.isDragging = True
-                        item.dragDelta = event.scenePos() - item.pos()
+                    self.isDragging = True
+                    scene.beginSelectionMove(event.scenePos(), self)
 
                 else:
                     if not shift:
@@ -464,20 +442,23 @@ class VPcontrol(QGraphicsItem):
                 sc = self.vpcontrolProps
                 ns = unicode(scene.mainWindow.namespaceWidget.currentText())+":"
 
-                if sc.control:
-                    core.select(ns+sc.control, add=True if shift else False)
+                commandQueue.push(id(sc), sc.control or sc.label, lambda: VPcontrol.execute(sc, ns, shift))
 
-                if sc.command:
-                    cmd = re.sub("\\$NAMESPACE\\b", "\""+ns+"\"", sc.command)
-                    exec cmd in {}
+    @staticmethod
+    def execute(props, ns, add=False):
+        if props.control:
+            mayaAccess.select([ns+props.control], add=True if add else False)
+
+        if props.command:
+            commandCache.execute(props.command, ns)
 
     def mouseReleaseEvent(self, event):
         if not self.isEditable:
             return
 
-        for item in self.scene().selectedItems():
-            item.isDragging = False
-            item.vpcontrolProps.position = (item.pos().x(), item.pos().y()) # update final position
+        if self.isDragging:
+            self.isDragging = False
+            self.scene().endSelectionMove()
 
     def wheelEvent(self, event):
         shift = event.modifiers() & Qt.ShiftModifier
@@ -487,14 +468,275 @@ class VPcontrol(QGraphicsItem):
             return
 
         if ctrl:
-            scaleFactor = 1.033 if event.delta() > 0 else 0.966
-            toInt = lambda x: int(round(x * scaleFactor))
-            for item in self.scene().selectedItems():
-                item.vpcontrolProps.size = (toInt(item.vpcontrolProps.size[0]), toInt(item.vpcontrolProps.size[1]))
+            self.scene().scaleSelection(1.033 if event.delta() > 0 else 0.966)
+
+class PresetParseTask(QRunnable):
+    '''
+    Parses (path, mtime, rootLabel) preset files on a thread pool, each file once for both its props and its index entry.
+    Results are emitted through signals.parsed, props and entry are None for a broken file.
+    '''
+    def __init__(self, files, signals):
+        super(PresetParseTask, self).__init__()
+
+        self.files = files
+        self.signals = signals
+
+    def run(self):
+        for path, mtime, rootLabel in self.files:
+            try:
+                element = ET.parse(path).getroot()
+                props = VPControlProps.fromXmlElement(element)
+                entry = PresetIndex.makeEntry(path, mtime, element, props, rootLabel)
+            except Exception:
+                props = entry = None
+
+            try:
+                self.signals.parsed.emit(path, mtime, props, entry)
+            except RuntimeError: # the library is gone
+                return
+
+class PresetParseSignals(QObject):
+    parsed = Signal(str, float, object, object)
+
+class ThumbnailCache(object):
+    ''' Rendered preset thumbnails and parsed props by file path, entries are dropped when mtime changes '''
+    Size = 96
+
+    def __init__(self):
+        self.entries = {}
+
+    def props(self, path, mtime):
+        entry = self.entries.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+
+    def setProps(self, path, mtime, props):
+        entry = self.entries.get(path)
+        if not entry or entry[0] != mtime:
+            self.entries[path] = [mtime, props, None]
+
+    def thumbnail(self, path, mtime):
+        entry = self.entries.get(path)
+        if not entry or entry[0] != mtime:
+            return None
+
+        if entry[2] is None:
+            entry[2] = ThumbnailCache.render(entry[1])
+        return entry[2]
+
+    @staticmethod
+    def render(props):
+        size = ThumbnailCache.Size
+        pixmap = QPixmap(size, size)
+        pixmap.fill(Qt.transparent)
+
+        r = props.boundingRect()
+        scale = min(1.0, (size-2) / float(max(r[2], r[3], 1)))
+
+        painter = QPainter(pixmap)
+        painter.translate((size - r[2]*scale) / 2.0, (size - r[3]*scale) / 2.0)
+        painter.scale(scale, scale)
+        VPcontrol.drawControl(painter, props, VPControlRenderCache.NormalState, False)
+        painter.end()
+        return pixmap
+
+class ControlLibrary(QObject):
+    '''
+    Presets of the local (maya project), shared (vptools) and studio ($VPTOOLS_STUDIO_DIRECTORY) controls directories.
+    The index is stored in the cache directory and kept current with QFileSystemWatcher.
+    Directories are only stat'ed on the UI thread, new or modified presets are parsed once on the thread pool
+    and the results fill both the thumbnails and the index.
+    '''
+    changed = Signal() # the index changed
+    parsed = Signal(str) # props of a preset are available
+
+    StudioDirectoryVariable = "VPTOOLS_STUDIO_DIRECTORY"
+    RescanDelay = 200 # ms, a copy of many files is one rescan
+    IndexDelay = 500 # ms, parse results are saved and shown in batches
+    FilesPerTask = 32
+
+    def __init__(self, **kwargs):
+        super(ControlLibrary, self).__init__(**kwargs)
+
+        self.index = None
+        self.watcher = None
+        self.labels = {} # directory: label
+
+        self.thumbnails = ThumbnailCache()
+        self.pending = set() # (path, mtime) being parsed
+        self.parseSignals = PresetParseSignals(self)
+        self.parseSignals.parsed.connect(self.presetParsed)
+
+        self.indexTimer = QTimer(self)
+        self.indexTimer.setSingleShot(True)
+        self.indexTimer.setInterval(ControlLibrary.IndexDelay)
+        self.indexTimer.timeout.connect(self.indexChanged)
+
+        self.pendingDirectories = set()
+        self.rescanTimer = QTimer(self)
+        self.rescanTimer.setSingleShot(True)
+        self.rescanTimer.setInterval(ControlLibrary.RescanDelay)
+        self.rescanTimer.timeout.connect(self.rescanPending)
+
+    def localDirectory(self):
+        return VPToolsLocalDirectory+"/controls"
+
+    def listRoots(self):
+        roots = [("local", self.localDirectory()), ("shared", VPToolsDirectory+"/controls")]
+
+        studioDirectory = os.environ.get(ControlLibrary.StudioDirectoryVariable)
+        if studioDirectory:
+            roots.append(("studio", studioDirectory+"/controls"))
+
+        return roots
+
+    def start(self):
+        ''' loads the index and watches the directories on first use '''
+        if self.index is not None:
+            return
+
+        self.index = PresetIndex(VPToolsCacheDirectory+"/presets.json")
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directoryChanged)
+
+        for label, directory in self.listRoots():
+            directory = os.path.normpath(directory)
+            self.labels[directory] = label
+
+            if os.path.isdir(directory):
+                self.watcher.addPath(directory)
+            self.refresh(directory)
+
+    def search(self, text=""):
+        self.start()
+        return [(path, self.index.entries[path]["mtime"]) for path in self.index.search(text)]
+
+    def refresh(self, directory):
+        ''' forgets removed presets and parses new or modified ones on the thread pool '''
+        stale, removed = self.index.staleFiles(directory)
+        self.parse(stale)
+
+        if removed:
+            self.indexTimer.start()
+
+    def parse(self, files):
+        ''' parses (path, mtime) presets on the thread pool unless they are already being parsed '''
+        toParse = []
+        for path, mtime in files:
+            if (path, mtime) not in self.pending:
+                self.pending.add((path, mtime))
+                toParse.append((path, mtime, self.labels.get(os.path.dirname(path), "")))
+
+        pool = QThreadPool.globalInstance()
+        for i in range(0, len(toParse), ControlLibrary.FilesPerTask):
+            pool.start(PresetParseTask(toParse[i:i+ControlLibrary.FilesPerTask], self.parseSignals))
 
-            self.scene().update()
+    def presetParsed(self, path, mtime, props, entry):
+        self.pending.discard((path, mtime))
+
+        current = self.index.entries.get(path)
+        if entry is None:
+            if current:
+                self.index.removeEntry(path)
+                self.indexTimer.start()
+            return
+
+        self.thumbnails.setProps(path, mtime, props)
+        if not current or current["mtime"] != mtime:
+            self.index.setEntry(path, entry)
+            self.indexTimer.start()
+
+        self.parsed.emit(path)
+
+    def indexChanged(self):
+        self.index.save()
+        self.changed.emit()
+
+    def directoryChanged(self, directory):
+        self.pendingDirectories.add(os.path.normpath(directory))
+        self.rescanTimer.start()
+
+    def rescan(self, directory):
+        directory = os.path.normpath(directory)
+        self.pendingDirectories.discard(directory)
+
+        if os.path.isdir(directory) and directory not in [os.path.normpath(d) for d in self.watcher.directories()]:
+            self.watcher.addPath(directory)
+
+        self.refresh(directory)
+
+    def rescanPending(self):
+        for directory in list(self.pendingDirectories):
+            self.rescan(directory)
+
+    def savePreset(self, props, name):
+        self.start()
+
+        directory = self.localDirectory()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        props.saveToFile("%s/%s.xml"%(directory, name))
+        self.rescan(directory)
+
+    def removePreset(self, path):
+        os.remove(path)
+        self.rescan(os.path.dirname(path))
+
+controlLibrary = ControlLibrary()
+
+class ControlsModel(QAbstractListModel):
+    ''' Presets in library order, thumbnails are rendered only when a view asks for them '''
+    PathRole = Qt.UserRole
+    PropsRole = Qt.UserRole + 1
+
+    def __init__(self, thumbnails, **kwargs):
+        super(ControlsModel, self).__init__(**kwargs)
+
+        self.thumbnails = thumbnails
+        self.entries = [] # (path, mtime)
+        self.rows = {} # path: row
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        path, mtime = self.entries[index.row()]
+
+        if role == Qt.DisplayRole:
+            return os.path.splitext(os.path.basename(path))[0]
+
+        elif role == Qt.DecorationRole:
+            return self.thumbnails.thumbnail(path, mtime)
+
+        elif role == ControlsModel.PathRole:
+            return path
+
+        elif role == ControlsModel.PropsRole:
+            return self.thumbnails.props(path, mtime)
+
+    def setEntries(self, entries):
+        self.beginResetModel()
+        self.entries = entries
+        self.rows = dict((path, row) for row, (path, _) in enumerate(entries))
+        self.endResetModel()
+
+    def presetUpdated(self, path):
+        row = self.rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
 
 class ControlsBrowser(QDialog):
+    '''
+    Preset library. Only visible thumbnails are rendered, presets the library has no props for yet
+    are parsed on a thread pool and thumbnails fill in as they arrive.
+    Filter: words match name, label or control, #words match tags (#local, #shared, #studio or the preset's own tags).
+    '''
     def __init__(self, **kwargs):
         super(ControlsBrowser, self).__init__(**kwargs)
 
@@ -508,55 +750,64 @@ class ControlsBrowser(QDialog):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.scene = QGraphicsScene()
-        self.view = QGraphicsView(self.scene)
+        self.filterWidget = QLineEdit()
+        self.filterWidget.setPlaceholderText("Filter, #tag")
+        self.filterWidget.textChanged.connect(self.update)
+        layout.addWidget(self.filterWidget)
+
+        self.model = ControlsModel(controlLibrary.thumbnails, parent=self)
+
+        size = ThumbnailCache.Size
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setIconSize(QSize(size, size))
+        self.view.setGridSize(QSize(size+20, size+30))
+        self.view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.view.setModel(self.model)
+        self.view.clicked.connect(self.itemClicked)
+        self.view.customContextMenuRequested.connect(self.itemContextMenu)
         layout.addWidget(self.view)
 
+        controlLibrary.changed.connect(self.update)
+        controlLibrary.parsed.connect(self.model.presetUpdated)
+
         self.update()
+        self.filterWidget.setFocus()
+
+    def done(self, result):
+        controlLibrary.changed.disconnect(self.update)
+        controlLibrary.parsed.disconnect(self.model.presetUpdated)
+        super(ControlsBrowser, self).done(result)
 
     def update(self):
-        self.scene.clear()
-
-        x, y = 0, 0
-        maxHeight = 0
-        NumColumns = 3
-        Offset = 10
-        for i, f in enumerate(VPControlProps.listControls()):
-            s = VPControlProps.loadFromFile(f)
-            item = VPcontrol(s, editable=False)
-            item.fileName = f
-            item.setPos(x,y)
-            self.scene.addItem(item)
-
-            item.mousePressEvent = lambda event, item=item: self.itemMousePressEvent(event, item)
-            item.contextMenuEvent = lambda event, item=item: self.itemContextMenuEvent(event, item)
-
-            bbox = item.boundingRect()
-            if i % NumColumns == 0 and i > 0:
-                x = 0
-                y += maxHeight
-                maxHeight = 0
-            else:
-                x += bbox.width() + Offset
-                if bbox.height() > maxHeight:
-                    maxHeight = bbox.height()
+        entries = controlLibrary.search(self.filterWidget.text())
+        self.model.setEntries(entries)
+
+        controlLibrary.parse([entry for entry in entries if not controlLibrary.thumbnails.props(*entry)])
+
+    def itemContextMenu(self, pos):
+        index = self.view.indexAt(pos)
+        if not index.isValid():
+            return
 
-    def itemContextMenuEvent(self, event, item):
         menu = QMenu()
 
         removeAction = menu.addAction("Remove")
-        removeAction.triggered.connect(lambda: self.removeItem(item))
+        removeAction.triggered.connect(lambda: self.removeItem(index.data(ControlsModel.PathRole)))
 
-        menu.exec_(event.screenPos())
+        menu.exec_(self.view.viewport().mapToGlobal(pos))
 
-    def removeItem(self, item):
+    def removeItem(self, path):
         if QMessageBox.question(self, "VPTools", "Remove?", QMessageBox.Yes | QMessageBox.Cancel, QMessageBox.Cancel) == QMessageBox.Yes:
-            os.remove(item.fileName)
-            self.update()
+            controlLibrary.removePreset(path)
 
-    def itemMousePressEvent(self, event, item):
-        if event.buttons() == Qt.LeftButton:
-            self.selectedProp = item.vpcontrolProps.copy()
+    def itemClicked(self, index):
+        props = index.data(ControlsModel.PropsRole)
+        if props:
+            self.selectedProp = props.copy()
             self.done(0)
 
 class VPToolsView(QGraphicsView):
@@ -587,8 +838,8 @@ class VPToolsView(QGraphicsView):
         cld.exec_()
 
         if cld.selectedProp:
-            self.scene().insertControl(cld.selectedProp, pos)
-            self.scene().update()
+            item = self.scene().insertControl(cld.selectedProp, pos)
+            self.scene().recordAdded([item])
     
     def keyPressEvent(self, event):
         key = event.key()
@@ -599,11 +850,19 @@ class VPToolsView(QGraphicsView):
         elif key == Qt.Key_Delete:
             if self.isEditable:
                 scene = self.scene()
-                
-                for item in scene.selectedItems():
-                    scene.removeItem(item)
+                scene.removeControls(scene.selectedItems())
+
+        elif event.matches(QKeySequence.Undo):
+            if self.isEditable:
+                self.scene().undo()
+
+        elif event.matches(QKeySequence.Redo) or (key == Qt.Key_Y and event.modifiers() == Qt.ControlModifier):
+            if self.isEditable:
+                self.scene().redo()
 
 class VPToolsScene(QGraphicsScene):
+    edited = Signal()
+
     def __init__(self, mainWindow, editable=False, **kwargs):
         super(VPToolsScene, self).__init__(**kwargs)
 
@@ -612,17 +871,96 @@ class VPToolsScene(QGraphicsScene):
         self.mainWindow = mainWindow
 
         self.startSelectionPosition = None
+        self.controlsOrigin = (VPControlProps.MinPositionX, VPControlProps.MinPositionY)
+        self.layoutLoader = None
+        self.updateJob = None
+
+        self.editJournal = None
+        self.nextControlId = 0
+        self.undoStack = UndoStack()
+
+        self.selectionMove = None # (items, starts, SelectionTransform, press position, anchor position)
 
         self.selectionChanged.connect(self.selectionChangedCallback)
+        self.visibilityResolver = VisibilityResolver(mayaAccess)
+        self.dependencyIndex = DependencyIndex()
+        self.controlsByNode = {}
+        self.selectedNodes = set()
 
     def updateControls(self):
-        ns = unicode(self.mainWindow.namespaceWidget.currentText())+":"
-        for item in self.listControls():
+        if self.updateJob and self.updateJob.isRunning():
+            self.updateJob.runToEnd()
+
+        for _ in self.iterUpdateControls():
+            pass
+
+    def updateControlsAsync(self):
+        ''' updateControls in time slices on the event loop, returns the job to connect to '''
+        if self.updateJob and self.updateJob.isRunning():
+            self.updateJob.runToEnd()
+
+        self.updateJob = TimeSlicedJob(self.iterUpdateControls(), parent=self)
+        self.updateJob.start()
+        return self.updateJob
+
+    def iterUpdateControls(self):
+        ''' yields the number of updated items after each item '''
+        ns = unicode(self.mainWindow.namespaceWidget.currentText())
+        resolver = self.visibilityResolver
+        resolver.reset(ns)
+        self.dependencyIndex.clear()
+        self.controlsByNode = {}
+
+        for i, item in enumerate(self.listControls()):
             ctrl = item.vpcontrolProps.control
-            ctrlNode = ns+ctrl
 
-            # item.setSelected(ctrlNode in cmds.ls(sl=True, an=True))
-            item.setEnabled((cmds.objExists(ctrlNode) and isActualVisible(ctrlNode)) or not ctrl)            
+            item.setEnabled(resolver.isEnabled(ctrl) or not ctrl)
+            self.dependencyIndex.add(item, resolver.dependencies(ctrl))
+
+            node = resolver.longName(ctrl)
+            if node:
+                self.controlsByNode.setdefault(node, []).append(item)
+
+            yield i+1
+
+        self.syncSelection(full=True)
+
+    def syncSelection(self, full=False):
+        ''' highlights the controls selected in Maya, only the items whose state changed are touched '''
+        if self.isEditable:
+            return
+
+        selected = set(mayaAccess.selection())
+
+        if full:
+            for item in self.selectedItems():
+                item.setSelected(False)
+            changed = selected
+        else:
+            changed = selected ^ self.selectedNodes
+
+        for node in changed:
+            isSelected = node in selected
+            for item in self.controlsByNode.get(node, []):
+                item.setSelected(isSelected)
+
+        self.selectedNodes = selected
+
+    def updateControlsForAttributes(self, attrs):
+        nodes = []
+        for attr in attrs:
+            nodes += self.visibilityResolver.affectedNodes(attr)
+
+        items = self.dependencyIndex.itemsFor(nodes)
+        if not items:
+            return
+
+        resolver = self.visibilityResolver
+        resolver.invalidate()
+
+        for item in items:
+            if item.scene() is self:
+                item.setEnabled(resolver.isEnabled(item.vpcontrolProps.control) or not item.vpcontrolProps.control)
         
     def insertControl(self, prop=None, pos=None):
         if self.isEditable:
@@ -637,8 +975,176 @@ class VPToolsScene(QGraphicsScene):
             self.addItem(item)
             item.setPos(pos)
 
+            item.controlId = self.nextControlId
+            self.nextControlId += 1
+
             return item
 
+    def recordAdded(self, items):
+        ''' journals inserted items and makes them one undo step '''
+        items = [item for item in items if item]
+        for item in items:
+            self.journalAdd(item)
+        self.undoStack.push([("add", item, None, None, None) for item in items])
+
+    def removeControls(self, items):
+        for item in items:
+            self.removeItem(item)
+            self.journalRemove(item)
+        self.undoStack.push([("remove", item, None, None, None) for item in items])
+
+    def recordChanged(self, attr, changes, mergeKey=None):
+        '''
+        Journals the changes already applied to the items and makes them one undo step,
+        changes are [(item, old, new)], pushes with the same mergeKey are merged.
+        Position values are (props position, item position).
+        '''
+        if not changes:
+            return
+
+        self.journalSet([item for item, _, _ in changes], attr)
+        self.undoStack.push([("set", item, attr, old, new) for item, old, new in changes], mergeKey)
+
+    def selectionBounds(self, items):
+        bounds = []
+        for item in items:
+            r = item.sceneBoundingRect()
+            bounds.append((r.x(), r.y(), r.width(), r.height()))
+        return bounds
+
+    def moveLimits(self):
+        ''' (left, top, right, bottom) the selection is kept within '''
+        return (0, 0, self.mainWindow.width()-25, self.mainWindow.height()-25)
+
+    def beginSelectionMove(self, scenePos, anchor):
+        '''
+        The selection moves as a unit, the union bounds and start positions are computed once here.
+        The items stay parented to the scene, the index isn't updated while they move.
+        '''
+        items = self.selectedItems()
+        starts = [(tuple(item.vpcontrolProps.position), (item.pos().x(), item.pos().y())) for item in items]
+        transform = SelectionTransform([start[1] for start in starts], self.selectionBounds(items))
+
+        self.selectionMove = (items, starts, transform, (scenePos.x(), scenePos.y()), (anchor.pos().x(), anchor.pos().y()))
+
+        if len(items) > 1:
+            self.setItemIndexMethod(QGraphicsScene.NoIndex) # don't update the index on every move
+
+    def moveSelection(self, scenePos, snap=False):
+        if not self.selectionMove:
+            return
+
+        items, _, transform, pressPos, anchorPos = self.selectionMove
+
+        dx = scenePos.x() - pressPos[0]
+        dy = scenePos.y() - pressPos[1]
+
+        if snap: # snap the clicked item, the others keep their offsets
+            dx = int(anchorPos[0] + dx) / 5 * 5 - anchorPos[0]
+            dy = int(anchorPos[1] + dy) / 5 * 5 - anchorPos[1]
+
+        dx, dy = transform.clampDelta(dx, dy, self.moveLimits())
+
+        for item, (x, y) in zip(items, transform.translated(dx, dy)):
+            item.setPos(x, y)
+
+    def endSelectionMove(self):
+        ''' writes the final positions to the props '''
+        if not self.selectionMove:
+            return
+
+        items, starts, _, _, _ = self.selectionMove
+        self.selectionMove = None
+        self.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
+
+        changes = []
+        for item, start in zip(items, starts):
+            position = (item.pos().x(), item.pos().y())
+            if position != start[1]:
+                item.vpcontrolProps.position = position
+                changes.append((item, start, (position, position)))
+
+        self.recordChanged("position", changes)
+
+    def arrangeSelection(self, op, arg):
+        ''' op is a SelectionTransform method: aligned, distributed or mirrored '''
+        items = self.selectedItems()
+        if len(items) < 2:
+            return
+
+        transform = SelectionTransform([(item.pos().x(), item.pos().y()) for item in items], self.selectionBounds(items))
+        positions = getattr(transform, op)(arg)
+
+        changes = []
+        for item, (x, y) in zip(items, positions):
+            start = (tuple(item.vpcontrolProps.position), (item.pos().x(), item.pos().y()))
+            if (x, y) != start[1]:
+                item.setPos(x, y)
+                item.vpcontrolProps.position = (x, y)
+                changes.append((item, start, ((x, y), (x, y))))
+
+        self.recordChanged("position", changes)
+
+    def scaleSelection(self, factor):
+        ''' Ctrl-wheel scaling, ticks over the same selection are one undo step '''
+        items = self.selectedItems()
+        oldSizes = [item.vpcontrolProps.size for item in items]
+
+        changes = []
+        for item, oldSize, size in zip(items, oldSizes, SelectionTransform.scaledSizes(oldSizes, factor)):
+            item.applyProp("size", size)
+            changes.append((item, oldSize, item.vpcontrolProps.size))
+
+        self.recordChanged("size", changes, mergeKey=("wheel", frozenset(items)))
+
+    def undo(self):
+        self.applyDeltas(self.undoStack.undo(), undo=True)
+
+    def redo(self):
+        self.applyDeltas(self.undoStack.redo(), undo=False)
+
+    def applyDeltas(self, deltas, undo):
+        ''' only the touched items are repainted '''
+        if not deltas:
+            return
+
+        for op, item, attr, old, new in deltas:
+            if op == "set":
+                value = old if undo else new
+                if attr == "position":
+                    item.vpcontrolProps.position = value[0]
+                    item.setPos(value[1][0], value[1][1])
+                else:
+                    item.applyProp(attr, value)
+                self.journalSet([item], attr)
+
+            elif (op == "add") == undo:
+                self.removeItem(item)
+                self.journalRemove(item)
+
+            else:
+                item.controlId = self.nextControlId # ids may be renumbered by a compaction
+                self.nextControlId += 1
+                self.addItem(item)
+                self.journalAdd(item)
+
+        self.mainWindow.vpcontrolPropsWidget.update()
+
+    def journalAdd(self, item):
+        if self.editJournal:
+            self.editJournal.add(item.controlId, item.vpcontrolProps)
+            self.edited.emit()
+
+    def journalRemove(self, item):
+        if self.editJournal:
+            self.editJournal.remove(item.controlId)
+            self.edited.emit()
+
+    def journalSet(self, items, attr):
+        if self.editJournal and items:
+            self.editJournal.setMany([(item.controlId, getattr(item.vpcontrolProps, attr)) for item in items], attr)
+            self.edited.emit()
+
     def listControls(self):
         return [item for item in self.items() if type(item) == VPcontrol]
 
@@ -664,11 +1170,34 @@ class VPToolsScene(QGraphicsScene):
             self.startSelectionPosition = event.scenePos()
             self.isDragging = True
 
+        elif not self.isEditable and buttons == Qt.LeftButton and self.itemAt(event.scenePos(), QTransform()) is None: # empty space, not a control or a proxy widget
+            self.startSelectionPosition = event.scenePos()
+            self.isDragging = True
+
     def mouseReleaseEvent(self, event):
         super(VPToolsScene, self).mouseReleaseEvent(event)
 
+        if self.isDragging and not self.isEditable:
+            items = self.selectedItems()
+            if items: # a click on empty space leaves Maya's selection alone
+                self.selectControls(items, event.modifiers())
+            self.syncSelection(full=True)
+
         self.isDragging = False
 
+    def selectControls(self, items, modifiers=Qt.NoModifier):
+        '''
+        Selects the controls of the items with a single select call.
+        Shift toggles, Ctrl deselects, Ctrl+Shift adds, otherwise the selection is replaced.
+        '''
+        ns = unicode(self.mainWindow.namespaceWidget.currentText())+":"
+        nodes = [ns+item.vpcontrolProps.control for item in items if item.vpcontrolProps.control and item.isEnabled()]
+
+        shift = modifiers & Qt.ShiftModifier
+        ctrl = modifiers & Qt.ControlModifier
+
+        mayaAccess.select(nodes, add=shift and ctrl, toggle=shift and not ctrl, deselect=ctrl and not shift)
+
     def wheelEvent(self, event):
         # wheelEvent = QWheelEvent(event.pos(), event.delta(), event.buttons(), event.modifiers())
         # w = QApplication.focusWidget()
@@ -678,15 +1207,152 @@ class VPToolsScene(QGraphicsScene):
     def importFromFile(self, path, append=True):
         if not append:
             self.clear()
+            self.nextControlId = 0
+            self.undoStack.clear()
+
+        for prop in layoutCache.iterFromFileList(path):
+            self.addControl(prop)
 
-        views = self.views()
-        for prop in VPControlProps.loadFromFileList(path):
-            self.addItem(VPcontrol(prop, editable=views[0].isEditable))
+    def importFromFileAsync(self, path, append=True):
+        ''' adds controls in chunks on the event loop, returns the loader to connect to '''
+        if not append:
+            self.clear()
+            self.nextControlId = 0
+            self.undoStack.clear()
+
+        self.layoutLoader = LayoutLoader(self, layoutCache.iterFromFileList(path), parent=self)
+        self.layoutLoader.start()
+        return self.layoutLoader
+
+    def addControl(self, prop):
+        minX, minY = VPControlProps.MinPositionX, VPControlProps.MinPositionY
+        if (minX, minY) != self.controlsOrigin:
+            # new minimum position, shift the controls that are already placed
+            dx = self.controlsOrigin[0] - minX
+            dy = self.controlsOrigin[1] - minY
+            for item in self.listControls():
+                item.moveBy(dx, dy)
+            self.controlsOrigin = (minX, minY)
+
+        item = VPcontrol(prop, editable=self.views()[0].isEditable)
+        item.controlId = self.nextControlId
+        self.nextControlId += 1
+        self.addItem(item)
+        return item
 
     def selectionChangedCallback(self):
         if self.isEditable:
             self.mainWindow.vpcontrolPropsWidget.update()
 
+class LayoutLoader(QObject):
+    ''' Feeds props from an iterator to the scene, ChunkSize controls per event loop iteration '''
+    ChunkSize = 100
+
+    progress = Signal(int)
+    finished = Signal()
+
+    def __init__(self, scene, props, **kwargs):
+        super(LayoutLoader, self).__init__(**kwargs)
+
+        self.scene = scene
+        self.props = props
+        self.count = 0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(lambda: self.loadChunk()) # through the attribute, instrumentation may wrap it later
+
+    def start(self):
+        self.timer.start(0)
+
+    def cancel(self):
+        self.timer.stop()
+
+    def isRunning(self):
+        return self.timer.isActive()
+
+    def loadChunk(self):
+        for _ in range(LayoutLoader.ChunkSize):
+            try:
+                prop = next(self.props)
+            except StopIteration:
+                self.timer.stop()
+                self.progress.emit(self.count)
+                self.finished.emit()
+                return
+
+            self.scene.addControl(prop)
+            self.count += 1
+
+        self.progress.emit(self.count)
+
+class CompactionTask(QRunnable):
+    ''' Writes the layout and removes the applied journals on a thread pool '''
+    def __init__(self, journal, props, generation, signals):
+        super(CompactionTask, self).__init__()
+
+        self.journal = journal
+        self.props = props
+        self.generation = generation
+        self.signals = signals
+
+    def run(self):
+        written = False
+        try:
+            written = self.journal.compact(self.props, self.generation)
+            if written:
+                layoutCache.write(self.journal.layoutPath, self.props)
+        except (IOError, OSError):
+            traceback.print_exc()
+
+        try:
+            self.signals.finished.emit(written)
+        except RuntimeError: # the window is gone
+            pass
+
+class CompactionSignals(QObject):
+    finished = Signal(bool)
+
+class TimeSlicedJob(QObject):
+    ''' Runs a generator on the event loop, at most TimeSlice seconds per event loop iteration '''
+    TimeSlice = 0.01
+
+    progress = Signal(int)
+    finished = Signal()
+
+    def __init__(self, generator, **kwargs):
+        super(TimeSlicedJob, self).__init__(**kwargs)
+
+        self.generator = generator
+        self.count = 0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(lambda: self.runSlice()) # through the attribute, instrumentation may wrap it later
+
+    def start(self):
+        self.timer.start(0)
+
+    def cancel(self):
+        self.timer.stop()
+
+    def isRunning(self):
+        return self.timer.isActive()
+
+    def runSlice(self, timeSlice=None):
+        endTime = time.time() + (TimeSlicedJob.TimeSlice if timeSlice is None else timeSlice)
+
+        for count in self.generator:
+            self.count = count
+            if time.time() > endTime:
+                self.progress.emit(self.count)
+                return
+
+        self.timer.stop()
+        self.progress.emit(self.count)
+        self.finished.emit()
+
+    def runToEnd(self):
+        self.runSlice(float("inf"))
+
 class TwoFieldWidget(QWidget):
     def __init__(self, **kwargs):
         super(TwoFieldWidget, self).__init__(**kwargs)
@@ -720,12 +1386,20 @@ class TwoFieldWidget(QWidget):
         return (int(self.widthWidget.text()), int(self.heightWidget.text()))
 
 class VPControlPropsWidget(QWidget):
+    CommandDelay = 400 # ms after the last keystroke before the command is applied
+
     def __init__(self, mainWindow, **kwargs):
         super(VPControlPropsWidget, self).__init__(**kwargs)
 
         self.isUpdating = False
         self.mainWindow = mainWindow
 
+        self.commandItems = None # items the pending command goes to
+        self.commandTimer = QTimer(self)
+        self.commandTimer.setSingleShot(True)
+        self.commandTimer.setInterval(VPControlPropsWidget.CommandDelay)
+        self.commandTimer.timeout.connect(self.commitCommand)
+
         self.setAttribute(Qt.WA_ShowWithoutActivating)
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.ToolTip)
 
@@ -776,7 +1450,7 @@ class VPControlPropsWidget(QWidget):
         self.controlWidget.returnPressed.connect(lambda: self.updateValue("control", str(self.controlWidget.text())))
 
         self.commandWidget = QTextEdit()
-        self.commandWidget.textChanged.connect(lambda: self.updateValue("command", unicode(self.commandWidget.toPlainText())))
+        self.commandWidget.textChanged.connect(self.commandChanged)
 
         layout = QGridLayout()
         layout.setDefaultPositioning(2, Qt.Horizontal)
@@ -825,28 +1499,58 @@ class VPControlPropsWidget(QWidget):
         self.setGeometry(rect.x()+rect.width(), rect.y()+20, 400, 400)
         self.setFocus()
 
-    def updateValue(self, type, value):
+    def commandChanged(self):
+        if self.isUpdating:
+            return
+
+        if not self.commandTimer.isActive():
+            self.commandItems = self.mainWindow.vptoolsScene.selectedItems()
+        self.commandTimer.start()
+
+    def commitCommand(self):
+        ''' applies a pending command edit to the items it was typed for '''
+        self.commandTimer.stop()
+
+        if self.commandItems is not None:
+            items, self.commandItems = self.commandItems, None
+            self.updateValue("command", unicode(self.commandWidget.toPlainText()), items)
+
+    def updateValue(self, type, value, items=None):
+        ''' sets the value to the selected items, only visual changes repaint and only the changed items '''
         if self.isUpdating:
             return
 
         scene = self.mainWindow.vptoolsScene
 
-        for item in scene.selectedItems():
-            sc = item.vpcontrolProps
-            item.vpcontrolProps.__setattr__(type, value)
+        if type=="command":
+            self.validateCommand(value)
 
-            if type=="rotation":
-                item.setRotation(value)
+        items = scene.selectedItems() if items is None else items
+        changes = []
+        for item in items:
+            if type=="command":
+                commandCache.discard(item.vpcontrolProps.command)
 
-            elif type=="invert":
-                oldPos = item.pos()
-                item.setPos(0,0)
-                item.setTransform(QTransform.fromScale(-1 if value else 1, 1))
-                item.setPos(oldPos)
+            oldValue = getattr(item.vpcontrolProps, type)
+            item.applyProp(type, value)
+            changes.append((item, oldValue, getattr(item.vpcontrolProps, type)))
 
             # print "set '%s' to '%s'"%(type, value)
 
-        scene.update()
+        scene.recordChanged(type, changes, mergeKey=("value", type, frozenset(items)))
+
+    def validateCommand(self, command):
+        try:
+            commandCache.compile(command)
+
+        except SyntaxError as e:
+            self.commandWidget.setStyleSheet("border: 1px solid red;")
+            self.commandWidget.setToolTip("Line %s: %s"%(e.lineno, e.msg))
+            return False
+
+        self.commandWidget.setStyleSheet("")
+        self.commandWidget.setToolTip("")
+        return True
 
     def colorClicked(self, widget):
         self.colorDialog = QColorDialog(parent=self.mainWindow)
@@ -857,6 +1561,9 @@ class VPControlPropsWidget(QWidget):
             widget.setStyleSheet("background: %s"%color2hex((c.red(), c.green(), c.blue())))
 
     def update(self):
+        ''' shows the last selected item, only the fields whose values differ are set '''
+        self.commitCommand()
+
         scene = self.mainWindow.vptoolsScene
         items = scene.selectedItems()
         if not items:
@@ -873,26 +1580,42 @@ class VPControlPropsWidget(QWidget):
 
         sc = items[-1].vpcontrolProps
 
-        self.typeWidget.setCurrentIndex(sc.type)
-        self.rotationWidget.setText(str(sc.rotation))
-        self.invertWidget.setChecked(sc.invert)
-        self.sizeWidget.setValue(sc.size[0], sc.size[1])
-        self.labelWidget.setText(sc.label)
-        self.pointsWidget.setText(",".join(["%d %d"%(x,y) for x,y in sc.points]))
-        self.controlWidget.setText(sc.control)
-        self.commandWidget.setText(sc.command)
+        if self.typeWidget.currentIndex() != sc.type:
+            self.typeWidget.setCurrentIndex(sc.type)
+
+        if self.invertWidget.isChecked() != sc.invert:
+            self.invertWidget.setChecked(sc.invert)
+
+        if self.gradientWidget.isChecked() != sc.gradient:
+            self.gradientWidget.setChecked(sc.gradient)
+
+        if (self.sizeWidget.widthWidget.text(), self.sizeWidget.heightWidget.text()) != (str(sc.size[0]), str(sc.size[1])):
+            self.sizeWidget.setValue(sc.size[0], sc.size[1])
 
-        self.colorWidget.color = QColor(sc.color[0], sc.color[1], sc.color[2])
-        self.colorWidget.setStyleSheet("background: %s"%color2hex(sc.color))
+        self.setFieldText(self.rotationWidget, str(sc.rotation))
+        self.setFieldText(self.labelWidget, sc.label)
+        self.setFieldText(self.pointsWidget, ",".join(["%d %d"%(x,y) for x,y in sc.points]))
+        self.setFieldText(self.controlWidget, sc.control)
+        self.setFieldText(self.roundRadiusWidget, str(sc.roundRadius))
 
-        self.textColorWidget.color = QColor(sc.textColor[0], sc.textColor[1], sc.textColor[2])
-        self.textColorWidget.setStyleSheet("background: %s"%color2hex(sc.textColor))
+        if self.commandWidget.toPlainText() != sc.command:
+            self.commandWidget.setPlainText(sc.command)
 
-        self.gradientWidget.setChecked(sc.gradient)
-        self.roundRadiusWidget.setText(str(sc.roundRadius))
+        self.setFieldColor(self.colorWidget, sc.color)
+        self.setFieldColor(self.textColorWidget, sc.textColor)
 
         self.isUpdating = False
 
+    def setFieldText(self, widget, text):
+        if widget.text() != text:
+            widget.setText(text)
+
+    def setFieldColor(self, widget, color):
+        c = getattr(widget, "color", None)
+        if c is None or (c.red(), c.green(), c.blue()) != tuple(color):
+            widget.color = QColor(color[0], color[1], color[2])
+            widget.setStyleSheet("background: %s"%color2hex(color))
+
 class MainControlWidget(QPushButton):
     def __init__(self, mainWindow, **kwargs):
         super(MainControlWidget, self).__init__(**kwargs)
@@ -917,6 +1640,10 @@ class MainControlWidget(QPushButton):
         editModeAction.triggered.connect(self.mainWindow.toggleEditMode)
         menu.addAction(editModeAction)
 
+        diagnosticsAction = QAction("Diagnostics", self)
+        diagnosticsAction.triggered.connect(self.mainWindow.showDiagnostics)
+        menu.addAction(diagnosticsAction)
+
         closeAction = QAction("Close", self)
         closeAction.triggered.connect(self.mainWindow.close)
         menu.addAction(closeAction)
@@ -924,6 +1651,8 @@ class MainControlWidget(QPushButton):
         menu.popup(event.globalPos())
 
 class VPToolsWindow(QWidget):
+    CompactionDelay = 10000 # ms without edits before user.xml is written
+
     def __init__(self, modelPanel, **kwargs):
         super(VPToolsWindow, self).__init__(**kwargs)
 
@@ -932,8 +1661,11 @@ class VPToolsWindow(QWidget):
 
         self.attributesForCallback = ["ikfk", "v"]
         self.selectionChangedCallbackId = -1
-        self.callbackIds = []
+        self.playbackCallbackId = -1
+        self.callbackScheduler = CallbackScheduler(self.flushAttributeChanges, parent=self)
+        self.attributeWatchers = AttributeWatcherRegistry(mayaAccess, self.attributesForCallback, self.attributeChangeCallback)
         
+        self.diagnosticsDialog = None
         self.appEventFilter = AppEventFilter(self)
         self.vptoolsEventFilter = VPToolsEventFilter(self)
 
@@ -947,21 +1679,42 @@ class VPToolsWindow(QWidget):
         self.setStyleSheet("background-color: rgba(0,0,0,0); border: 0px;")
         self.setWindowFlags(self.activeFlags)
 
+        self.characterNamespaces = CharacterNamespaces()
+        self.characterNamespaces.onChanged = self.namespacesChangedCallback
+
+        self.namespacesTimer = QTimer(self)
+        self.namespacesTimer.setSingleShot(True)
+        self.namespacesTimer.timeout.connect(lambda: self.updateNamespaces() and self.vptoolsScene.updateControls())
+
         self.namespaceWidget = QComboBox()
-        self.namespaceWidget.addItems(listCharacterReferences())
+
+        self.progressWidget = QProgressBar()
+        self.progressWidget.setFixedSize(150, 14)
+        self.progressWidget.setTextVisible(True)
+        self.progressWidget.hide()
 
         self.vptoolsScene = VPToolsScene(self)
         self.vptoolsScene.addWidget(MainControlWidget(self))
         w = self.vptoolsScene.addWidget(self.namespaceWidget)
         w.setPos(80,0)
+        w = self.vptoolsScene.addWidget(self.progressWidget)
+        w.setPos(0,30)
 
         self.vptoolsView = VPToolsView(self.vptoolsScene, editable=False, mainWindow=self)
         self.vpcontrolPropsWidget = VPControlPropsWidget(self, parent=None)
 
-        if os.path.exists(VPToolsLocalDirectory+"/user.xml"):
-            self.vptoolsScene.importFromFile(VPToolsLocalDirectory+"/user.xml")
-        else:
-            self.vptoolsScene.importFromFile(VPToolsDirectory+"/biped.xml")
+        self.editJournal = EditJournal(VPToolsLocalDirectory+"/user.xml")
+        self.vptoolsScene.editJournal = self.editJournal
+        self.isCompacting = False
+
+        self.compactionSignals = CompactionSignals(self)
+        self.compactionSignals.finished.connect(self.compactionFinished)
+
+        self.compactionTimer = QTimer(self)
+        self.compactionTimer.setSingleShot(True)
+        self.compactionTimer.setInterval(VPToolsWindow.CompactionDelay)
+        self.compactionTimer.timeout.connect(self.compactJournal)
+        self.vptoolsScene.edited.connect(self.compactionTimer.start)
 
         splitter = QSplitter(Qt.Horizontal)
 
@@ -975,14 +1728,88 @@ class VPToolsWindow(QWidget):
         self.setLayout(layout)
 
         self.updateGeometry()
-        self.vptoolsScene.updateControls()
+        self.startLoading()
+
+    def startLoading(self):
+        '''
+        Staged startup, the window shows up at once with the main control:
+        namespaces, then the layout in chunks, then visibility in time slices, then callbacks.
+        Time to first paint and time to interactive are recorded as startup.* stats.
+        '''
+        self.startupTime = time.time()
+        self.startupTimes = {}
+
+        self.progressWidget.setRange(0, 0)
+        self.progressWidget.setFormat("Loading namespaces")
+        self.progressWidget.show()
+
+        QTimer.singleShot(0, self.loadNamespaces)
+
+    def loadNamespaces(self):
+        self.updateNamespaces()
+
+        # edits of a session that didn't end with a compaction
+        if self.editJournal.recover(VPToolsDirectory+"/biped.xml"):
+            print "VPTools: restored unsaved edits to '%s'"%self.editJournal.layoutPath
+
+        if os.path.exists(VPToolsLocalDirectory+"/user.xml"):
+            loader = self.vptoolsScene.importFromFileAsync(VPToolsLocalDirectory+"/user.xml")
+        else:
+            loader = self.vptoolsScene.importFromFileAsync(VPToolsDirectory+"/biped.xml")
+
+        self.progressWidget.setFormat("Loading layout")
+        loader.progress.connect(lambda count: self.updateGeometry())
+        loader.finished.connect(self.loadVisibility)
+
+    def loadVisibility(self):
+        self.progressWidget.setRange(0, max(len(self.vptoolsScene.listControls()), 1))
+        self.progressWidget.setValue(0)
+        self.progressWidget.setFormat("Updating controls %p%")
+
+        job = self.vptoolsScene.updateControlsAsync()
+        job.progress.connect(self.progressWidget.setValue)
+        job.finished.connect(self.finishLoading)
+
+    def finishLoading(self):
         self.installCallbacks()
+        self.progressWidget.hide()
+        self.setStartupTime("interactive")
+
+    def setStartupTime(self, name):
+        if name not in self.startupTimes:
+            self.startupTimes[name] = time.time() - self.startupTime
+            instrumentation.record("startup."+name, self.startupTimes[name])
+
+    def paintEvent(self, event):
+        super(VPToolsWindow, self).paintEvent(event)
+        self.setStartupTime("firstPaint")
 
     def update(self):
-        self.namespaceWidget.clear()
-        self.namespaceWidget.addItems(listCharacterReferences())        
+        self.updateNamespaces()
         self.updateGeometry()
         self.vptoolsScene.updateControls()
+
+    def updateNamespaces(self):
+        ''' updates the namespace combo in place, returns True if the current namespace changed '''
+        namespaces = self.characterNamespaces.get()
+        widget = self.namespaceWidget
+        current = widget.currentText()
+
+        for i in reversed(range(widget.count())):
+            if widget.itemText(i) not in namespaces:
+                widget.removeItem(i)
+
+        for i, ns in enumerate(namespaces):
+            if widget.itemText(i) != ns:
+                j = widget.findText(ns)
+                if j > i:
+                    widget.removeItem(j)
+                widget.insertItem(i, ns)
+
+        return widget.currentText() != current
+
+    def namespacesChangedCallback(self):
+        self.namespacesTimer.start(0)
         
     def updateGeometry(self):
         self.setGeometry(getViewportRect(self.viewportWidget))
@@ -992,29 +1819,27 @@ class VPToolsWindow(QWidget):
         region = QRegion(rect.x(), rect.y(), rect.width()+10, rect.height()+10)
         self.setMask(region)
 
-    def attributeChangeCallback(self):
-        self.vptoolsScene.updateControls()
+    def attributeChangeCallback(self, attr):
+        self.callbackScheduler.notify(attr)
+
+    def flushAttributeChanges(self, attrs):
+        self.vptoolsScene.updateControlsForAttributes(attrs)
+
+    def playbackChangedCallback(self):
+        self.callbackScheduler.setPlayback(mayaAccess.isPlayingBack())
         
     def selectionChangedCallback(self):
         if self.isEditable:
             return
 
-        ls = cmds.ls(sl=True)
-        if not ls:
-            return
-        node = ls[0]
+        self.vptoolsScene.syncSelection()
 
-        for id in self.callbackIds:
-            core.scriptJob(kill=id)
-        self.callbackIds = []
-        
-        for a in self.attributesForCallback:
-            attr = "%s.%s"%(node, a)
-            if cmds.objExists(attr):
-                self.callbackIds.append( core.scriptJob(ac=[attr, self.attributeChangeCallback]) )
+        self.attributeWatchers.watch(self.vptoolsScene.selectedNodes)
     
     def installCallbacks(self):
-        self.selectionChangedCallbackId = core.scriptJob(e=["SelectionChanged", self.selectionChangedCallback])
+        self.selectionChangedCallbackId = mayaAccess.addEventCallback("SelectionChanged", self.selectionChangedCallback)
+        self.playbackCallbackId = mayaAccess.addConditionCallback("playingBack", self.playbackChangedCallback)
+        self.characterNamespaces.installCallbacks()
         
         self.viewportWidget.installEventFilter(self.vptoolsEventFilter)
         QApplication.instance().installEventFilter(self.appEventFilter)
@@ -1023,14 +1848,18 @@ class VPToolsWindow(QWidget):
         self.viewportWidget.removeEventFilter(self.vptoolsEventFilter)
         QApplication.instance().removeEventFilter(self.appEventFilter)
         
-        core.scriptJob(kill=self.selectionChangedCallbackId)        
-        for id in self.callbackIds:
-            core.scriptJob(kill=id)
-        self.callbackIds = []
+        mayaAccess.removeScriptJob(self.selectionChangedCallbackId)
+        mayaAccess.removeScriptJob(self.playbackCallbackId)
+        self.attributeWatchers.clear()
+        self.callbackScheduler.cancel()
+        self.characterNamespaces.removeCallbacks()
         
         self.selectionChangedCallbackId = -1
+        self.playbackCallbackId = -1
     
     def toggleEditMode(self):
+        self.vpcontrolPropsWidget.commitCommand()
+
         self.isEditable = not self.isEditable
         self.vptoolsView.isEditable = self.isEditable
         self.vptoolsScene.isEditable = self.isEditable
@@ -1048,17 +1877,217 @@ class VPToolsWindow(QWidget):
         else:
             self.setStyleSheet("background-color: rgba(0,0,0,0); border: 0px;")
             self.updateGeometry()
-
-            props = [item.vpcontrolProps for item in self.vptoolsScene.listControls()]
-            VPControlProps.saveToFileList(VPToolsLocalDirectory + "/user.xml", props)
-            print "Saved to '%s'"%(VPToolsLocalDirectory + "/user.xml")
+            self.vptoolsScene.updateControls()
+            self.compactJournal()
 
         self.setWindowFlags(self.defaultFlags if self.isEditable else self.activeFlags)
         self.setWindowOpacity(0.8 if self.isEditable else 1)
         self.show()
 
+    def compactJournal(self):
+        ''' writes user.xml on the thread pool, new edits go to the journal of the next generation '''
+        self.compactionTimer.stop()
+
+        if self.isCompacting:
+            self.compactionTimer.start()
+            return
+
+        if not self.editJournal.count:
+            return
+
+        items = sorted(self.vptoolsScene.listControls(), key=lambda item: item.controlId)
+        props = [item.vpcontrolProps.copy() for item in items]
+
+        # ids of the next generation are positions in the compacted layout
+        for i, item in enumerate(items):
+            item.controlId = i
+        self.vptoolsScene.nextControlId = len(items)
+
+        generation = self.editJournal.rotate()
+        self.isCompacting = True
+        QThreadPool.globalInstance().start(CompactionTask(self.editJournal, props, generation, self.compactionSignals))
+
+    def compactionFinished(self, written):
+        self.isCompacting = False
+
+        if written:
+            print "Saved to '%s'"%self.editJournal.layoutPath
+
+    def showDiagnostics(self):
+        if not self.diagnosticsDialog:
+            self.diagnosticsDialog = DiagnosticsDialog(self, parent=getMayaMainWindow())
+        self.diagnosticsDialog.show()
+
     def closeEvent(self, event):
+        if self.vptoolsScene.layoutLoader:
+            self.vptoolsScene.layoutLoader.cancel()
+        if self.vptoolsScene.updateJob:
+            self.vptoolsScene.updateJob.cancel()
+
         self.removeCallbacks()
+        self.editJournal.close() # the journal is compacted on the next start
+
+        if self.diagnosticsDialog:
+            self.diagnosticsDialog.close()
+
+class CallbackScheduler(QObject):
+    '''
+    Collects dirty keys from Maya callbacks and flushes them at most once per event loop iteration.
+    During playback the flush is either suspended until playback stops or rate limited.
+    '''
+    PlaybackSuspend = 0
+    PlaybackThrottle = 1
+
+    def __init__(self, callback, playbackMode=PlaybackSuspend, playbackInterval=250, **kwargs):
+        super(CallbackScheduler, self).__init__(**kwargs)
+
+        self.callback = callback
+        self.playbackMode = playbackMode
+        self.playbackInterval = playbackInterval
+        self.isPlayingBack = False
+
+        self.pending = set()
+        self.notificationCount = 0
+        self.mergedCount = 0
+        self.flushCount = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(lambda: self.flush()) # through the attribute, instrumentation may wrap it later
+
+    def notify(self, key):
+        self.notificationCount += 1
+        if key in self.pending:
+            self.mergedCount += 1
+        self.pending.add(key)
+
+        if self.timer.isActive():
+            return
+
+        if not self.isPlayingBack:
+            self.timer.start(0)
+
+        elif self.playbackMode == CallbackScheduler.PlaybackThrottle:
+            self.timer.start(self.playbackInterval)
+
+    def setPlayback(self, playing):
+        self.isPlayingBack = bool(playing)
+
+        if self.isPlayingBack:
+            if self.playbackMode == CallbackScheduler.PlaybackSuspend:
+                self.timer.stop()
+
+        elif self.pending:
+            self.timer.start(0)
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        keys = self.pending
+        self.pending = set()
+        self.flushCount += 1
+        self.callback(keys)
+
+    def cancel(self):
+        self.timer.stop()
+        self.pending = set()
+
+    def stats(self):
+        return {"notifications": self.notificationCount,
+                "merged": self.mergedCount,
+                "flushes": self.flushCount,
+                "pending": len(self.pending)}
+
+class DiagnosticsDialog(QDialog):
+    ''' Live instrumentation stats, the profile can be exported as json for bug reports '''
+    Columns = ["Name", "Count", "Per Sec", "Last ms", "Avg ms", "Max ms"]
+
+    def __init__(self, mainWindow, **kwargs):
+        super(DiagnosticsDialog, self).__init__(**kwargs)
+
+        self.mainWindow = mainWindow
+
+        self.setWindowTitle("VPTools Diagnostics")
+        self.resize(600, 400)
+
+        self.enabledWidget = QCheckBox("Enabled")
+        self.enabledWidget.setChecked(instrumentation.isEnabled)
+        self.enabledWidget.stateChanged.connect(self.enabledChanged)
+
+        self.infoWidget = QLabel()
+
+        self.statsWidget = QTableWidget(0, len(DiagnosticsDialog.Columns))
+        self.statsWidget.setHorizontalHeaderLabels(DiagnosticsDialog.Columns)
+        self.statsWidget.horizontalHeader().setStretchLastSection(True)
+        self.statsWidget.verticalHeader().hide()
+
+        resetButton = QPushButton("Reset")
+        resetButton.clicked.connect(lambda: (instrumentation.reset(), self.update()))
+
+        exportButton = QPushButton("Export...")
+        exportButton.clicked.connect(self.export)
+
+        buttonsLayout = QHBoxLayout()
+        buttonsLayout.addWidget(self.enabledWidget)
+        buttonsLayout.addStretch(1)
+        buttonsLayout.addWidget(resetButton)
+        buttonsLayout.addWidget(exportButton)
+
+        layout = QVBoxLayout()
+        layout.addLayout(buttonsLayout)
+        layout.addWidget(self.infoWidget)
+        layout.addWidget(self.statsWidget)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def showEvent(self, event):
+        self.update()
+        self.timer.start(500)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+
+    def enabledChanged(self):
+        if self.enabledWidget.isChecked():
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def info(self):
+        scene = self.mainWindow.vptoolsScene
+        return {"items": len(scene.listControls()),
+                "callbacks": self.mainWindow.callbackScheduler.stats(),
+                "startup": self.mainWindow.startupTimes,
+                "commandQueue": commandQueue.depth(),
+                "renderCache": len(VPcontrol.renderCache.pixmaps)}
+
+    def update(self):
+        info = self.info()
+        self.infoWidget.setText("Items: %d    Callbacks: %d (merged %d)    Command queue: %d    Cached pixmaps: %d"%(
+            info["items"], info["callbacks"]["notifications"], info["callbacks"]["merged"], info["commandQueue"], info["renderCache"]))
+
+        summary = instrumentation.summary()
+        self.statsWidget.setRowCount(len(summary))
+        for row, name in enumerate(sorted(summary)):
+            stat = summary[name]
+            values = [name,
+                      "%d"%stat["count"],
+                      "%.1f"%stat["perSecond"],
+                      "%.2f"%(stat["last"]*1000),
+                      "%.2f"%(stat["avg"]*1000),
+                      "%.2f"%(stat["max"]*1000)]
+
+            for column, value in enumerate(values):
+                self.statsWidget.setItem(row, column, QTableWidgetItem(value))
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Profile", VPToolsLocalDirectory+"/profile.json", "*.json")
+        if path:
+            instrumentation.dump(path, info=self.info())
+            print "Saved to '%s'"%path
 
 class AppEventFilter(QObject):
     def __init__(self, mainWindow, **kwargs):
@@ -1090,45 +2119,67 @@ class VPToolsEventFilter(QObject):
 
         return QObject.eventFilter(self, obj, event)
     
-def listCharacterReferences():
-    namespaces = []
-    for ref in core.ls(type="reference"):
-        try:
-            isLoaded = core.referenceQuery(ref, isLoaded=True)
-        except:
-            continue
+class CharacterNamespaces(object):
+    '''
+    Cached result of listCharacterReferences.
+    The cache is dropped only by reference load, unload, create and remove callbacks (and new/open scene).
+    '''
+    SceneMessages = ["kAfterLoadReference",
+                     "kAfterUnloadReference",
+                     "kAfterCreateReference",
+                     "kAfterRemoveReference",
+                     "kAfterImportReference",
+                     "kAfterOpen",
+                     "kAfterNew"]
+
+    def __init__(self, markerControl=None):
+        self.markerControl = markerControl
+        self.namespaces = None
+        self.callbackIds = []
+        self.onChanged = None
 
-        if not isLoaded:
-            continue
+    def get(self):
+        if self.namespaces is None:
+            self.namespaces = listCharacterReferences(self.markerControl or CharacterMarkerControl)
+        return list(self.namespaces)
 
-        ns = core.referenceQuery(ref, shn=True, namespace=True)
-        if core.objExists(ns+":M_spine_fk_1_control"):
-            namespaces.append(ns)
+    def invalidate(self, *args):
+        self.namespaces = None
 
-    return namespaces
+        if self.onChanged:
+            self.onChanged()
+
+    def installCallbacks(self):
+        for msg in CharacterNamespaces.SceneMessages:
+            self.callbackIds.append(mayaAccess.addSceneCallback(msg, self.invalidate))
+
+    def removeCallbacks(self):
+        for callbackId in self.callbackIds:
+            mayaAccess.removeCallback(callbackId)
+        self.callbackIds = []
+
+def listCharacterReferences(markerControl=CharacterMarkerControl):
+    return [ns for ns in mayaAccess.referenceNamespaces() if mayaAccess.objExists(ns+":"+markerControl)]
 
 def isActualVisible(obj, checkShapes=True):
-    obj = core.PyNode(obj)
+    obj = mayaAccess.longNames(obj)[0]
 
-    visShapes = False
     if checkShapes:
-        for sh in obj.getShapes():
-            visShapes = visShapes or sh.v.get()
-    else:
-        visShapes = True
+        shapes = mayaAccess.shapes(obj)
+        if shapes and not any(mayaAccess.getVisibility(sh) for sh in shapes):
+            return False
 
-    if obj.getShapes() and not visShapes:
+    if not mayaAccess.getVisibility(obj):
         return False
 
-    if obj.hasAttr("visibility") and obj.v.get()==False:
-        return False
-
-    if obj.getParent():
-        return isActualVisible(obj.getParent(), False)
+    parent = obj.rpartition("|")[0]
+    if parent:
+        return isActualVisible(parent, False)
     else:
         return True
 
-mayaMainWindow = wrapInstance(long(apiUI.MQtUtil.mainWindow()), QWidget)
+def getMayaMainWindow():
+    return wrapInstance(long(apiUI.MQtUtil.mainWindow()), QWidget)
 
 def getViewportWidget(name):
     view = apiUI.M3dView()
@@ -1182,12 +2233,30 @@ class MenuAction(QWidgetAction):
     def createWidget(self, parent):
         return ActionWidget(self.label, self.buttonFunc, self.isTitle, parent)
 
+instrumentation = Instrumentation()
+instrumentation.register(VPToolsScene, "updateControls")
+instrumentation.register(VPToolsScene, "updateControlsForAttributes")
+instrumentation.register(VPToolsScene, "syncSelection")
+instrumentation.register(VPcontrol, "paint")
+instrumentation.register(CallbackScheduler, "notify", "callbacks.notify")
+instrumentation.register(CallbackScheduler, "flush", "callbacks.flush")
+instrumentation.register(VPToolsScene, "importFromFile", "io.VPToolsScene.importFromFile")
+instrumentation.register(LayoutLoader, "loadChunk", "io.LayoutLoader.loadChunk")
+instrumentation.register(TimeSlicedJob, "runSlice")
+instrumentation.register(LayoutCache, "write", "io.LayoutCache.write")
+instrumentation.register(EditJournal, "write", "io.EditJournal.write")
+instrumentation.register(EditJournal, "compact", "io.EditJournal.compact")
+instrumentation.register(CommandQueue, "flush", "command.CommandQueue.flush")
+instrumentation.register(CommandCache, "execute", "command.CommandCache.execute")
+
 def vptools():
     if not os.path.exists(VPToolsLocalDirectory):
         os.makedirs(VPToolsLocalDirectory)
     
-    # panel = core.getPanel(wf=True)
+    # panel = cmds.getPanel(wf=True)
     vptoolsWindow = VPToolsWindow("modelPanel4")
     vptoolsWindow.show()
-    
-vptools()    
+    return vptoolsWindow
+
+if __name__ == "__main__":
+    vptools()